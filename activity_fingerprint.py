@@ -0,0 +1,146 @@
+"""
+Activity fingerprints shared by myWhoosh2Garmin.py and strava/main.py.
+
+A fingerprint is the start time, the duration and a hash of the power and
+heart rate streams downsampled to 30 second means. It identifies a ride
+even when its bytes differ, e.g. the original MyWhoosh file exported from
+Strava and the cleaned-up file without temperature. Fingerprints are kept
+in a local SQLite index and looked up by primary key.
+"""
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from fit_codec import (
+    FitColumns,
+    RECORD_MESSAGE,
+    decode_fit_columns,
+    field_values,
+)
+
+
+FINGERPRINTS_PATH = Path(__file__).resolve().parent / "activity_fingerprints.db"
+DOWNSAMPLE_SECONDS = 30
+
+
+class ActivityFingerprint(NamedTuple):
+    """Identity of a ride, independent of how its file was encoded."""
+
+    start_time: int
+    duration: int
+    stream_hash: str
+
+    @property
+    def key(self) -> str:
+        return f"{self.start_time}:{self.duration}:{self.stream_hash}"
+
+    @classmethod
+    def from_key(cls, key: str) -> "ActivityFingerprint":
+        """Rebuild a fingerprint from its key."""
+        start_time, duration, stream_hash = key.split(":")
+        return cls(int(start_time), int(duration), stream_hash)
+
+
+def fingerprint_fit(data: bytes) -> Optional[ActivityFingerprint]:
+    """
+    Fingerprint the records of a FIT file.
+
+    Returns:
+        ActivityFingerprint or None: None if the file is not a FIT file
+        or has no timestamped records.
+    """
+    try:
+        fit = decode_fit_columns(data)
+    except ValueError:
+        return None
+    runs = [segment for segment in fit.segments
+            if isinstance(segment, FitColumns)
+            and segment.definition.global_number == RECORD_MESSAGE]
+    if not runs:
+        return None
+    timestamps = np.concatenate([field_values(run, "timestamp")
+                                 for run in runs])
+    power = np.concatenate([field_values(run, "power") for run in runs])
+    heart_rate = np.concatenate([field_values(run, "heart_rate")
+                                 for run in runs])
+    timed = timestamps > 0
+    if not timed.any():
+        return None
+    timestamps, power, heart_rate = (
+        timestamps[timed], power[timed], heart_rate[timed]
+    )
+    start_time = int(timestamps.min())
+    duration = int(timestamps.max()) - start_time
+    buckets = (timestamps - start_time) // DOWNSAMPLE_SECONDS
+    counts = np.bincount(buckets)
+    filled = counts > 0
+    streams = np.stack([
+        np.bincount(buckets, weights=power)[filled] / counts[filled],
+        np.bincount(buckets, weights=heart_rate)[filled] / counts[filled],
+    ])
+    digest = hashlib.sha1(
+        np.round(streams).astype("<i4").tobytes()
+    ).hexdigest()
+    return ActivityFingerprint(start_time, duration, digest[:16])
+
+
+def fingerprint_fit_file(path: Path) -> Optional[ActivityFingerprint]:
+    """Fingerprint a FIT file on disk."""
+    return fingerprint_fit(Path(path).read_bytes())
+
+
+class FingerprintIndex:
+    """
+    SQLite index of the rides already on Garmin Connect.
+
+    Only myWhoosh2Garmin.py adds rides, once they are uploaded;
+    strava/main.py only looks them up.
+    """
+
+    def __init__(self, db_file: Path = FINGERPRINTS_PATH):
+        self.conn = sqlite3.connect(str(db_file), check_same_thread=False)
+        self.lock = threading.Lock()
+        self._create_table()
+
+    def _create_table(self):
+        """Create database table if it doesn't exist."""
+        query = """
+        CREATE TABLE IF NOT EXISTS fingerprints (
+            fingerprint TEXT PRIMARY KEY,
+            source TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+        with self.lock:
+            self.conn.execute(query)
+            self.conn.commit()
+
+    def lookup(self, fingerprint: ActivityFingerprint
+               ) -> Optional[Tuple[str, str]]:
+        """Return the (source, file name) a ride was first seen as."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT source, file_name FROM fingerprints "
+                "WHERE fingerprint = ?",
+                (fingerprint.key,)
+            ).fetchone()
+
+    def add(self, fingerprint: ActivityFingerprint, source: str,
+            file_name: str):
+        """Record a ride, keeping the first source it was seen from."""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO fingerprints "
+                "(fingerprint, source, file_name) VALUES (?, ?, ?)",
+                (fingerprint.key, source, file_name)
+            )
+            self.conn.commit()
+
+    def close(self):
+        """Close database connection."""
+        self.conn.close()
@@ -0,0 +1,731 @@
+"""
+Byte-level helpers for FIT files.
+
+Decodes runs of same-definition data messages straight into NumPy
+structured arrays (one column per field) and encodes them back, so
+per-record work becomes bulk array operations. Field transforms (drop,
+rename, scale, clamp) are compiled once per definition into a plan that
+is applied to whole runs. FitStreamDecoder does the same for a file that
+is still being written, one batch of appended bytes at a time.
+
+FIT file layout reference:
+https://developer.garmin.com/fit/protocol/
+"""
+import struct
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+
+FIT_SIGNATURE = b".FIT"
+FIT_HEADER_SIZE = 14
+COMPRESSED_TIMESTAMP_HEADER = 0x80
+DEFINITION_HEADER = 0x40
+DEVELOPER_DATA_HEADER = 0x20
+LOCAL_TYPE_MASK = 0x0F
+SESSION_MESSAGE = 18
+LAP_MESSAGE = 19
+RECORD_MESSAGE = 20
+MESSAGE_NUMBERS = {
+    "file_id": 0,
+    "session": SESSION_MESSAGE,
+    "lap": LAP_MESSAGE,
+    "record": RECORD_MESSAGE,
+    "event": 21,
+    "device_info": 23,
+    "activity": 34,
+}
+TRANSFORM_ACTIONS = ("drop", "rename", "scale", "clamp")
+# Base type: (NumPy type code, invalid value). Strings and unknown base
+# types are kept as raw bytes.
+BASE_TYPES = {
+    0x00: ("u1", 0xFF),
+    0x01: ("i1", 0x7F),
+    0x02: ("u1", 0xFF),
+    0x83: ("i2", 0x7FFF),
+    0x84: ("u2", 0xFFFF),
+    0x85: ("i4", 0x7FFFFFFF),
+    0x86: ("u4", 0xFFFFFFFF),
+    0x88: ("f4", None),
+    0x89: ("f8", None),
+    0x0A: ("u1", 0),
+    0x8B: ("u2", 0),
+    0x8C: ("u4", 0),
+    0x0D: ("u1", 0xFF),
+    0x8E: ("i8", 0x7FFFFFFFFFFFFFFF),
+    0x8F: ("u8", 0xFFFFFFFFFFFFFFFF),
+    0x90: ("u8", 0),
+}
+ZERO_INVALID_BASE_TYPES = {0x07, 0x0A, 0x8B, 0x8C, 0x90}
+FIELD_NAMES = {
+    SESSION_MESSAGE: {
+        253: "timestamp", 2: "start_time", 5: "sport",
+        7: "total_elapsed_time", 8: "total_timer_time",
+        9: "total_distance", 11: "total_calories", 14: "avg_speed",
+        15: "max_speed", 16: "avg_heart_rate", 17: "max_heart_rate",
+        18: "avg_cadence", 19: "max_cadence", 20: "avg_power",
+        21: "max_power",
+    },
+    LAP_MESSAGE: {
+        253: "timestamp", 2: "start_time", 7: "total_elapsed_time",
+        8: "total_timer_time", 9: "total_distance", 11: "total_calories",
+        13: "avg_speed", 14: "max_speed", 15: "avg_heart_rate",
+        16: "max_heart_rate", 17: "avg_cadence", 18: "max_cadence",
+        19: "avg_power", 20: "max_power",
+    },
+    RECORD_MESSAGE: {
+        253: "timestamp", 0: "position_lat", 1: "position_long",
+        2: "altitude", 3: "heart_rate", 4: "cadence", 5: "distance",
+        6: "speed", 7: "power", 13: "temperature",
+        29: "accumulated_power", 73: "enhanced_speed",
+        78: "enhanced_altitude",
+    },
+}
+CRC_TABLE = (
+    0x0000, 0xCC01, 0xD801, 0x1400, 0xF001, 0x3C00, 0x2800, 0xE401,
+    0xA001, 0x6C00, 0x7800, 0xB401, 0x5000, 0x9C01, 0x8801, 0x4400,
+)
+
+
+def fit_crc(data: bytes, crc: int = 0) -> int:
+    """Return the FIT CRC-16 of a byte string."""
+    for byte in data:
+        tmp = CRC_TABLE[crc & 0xF]
+        crc = (crc >> 4) & 0x0FFF
+        crc = crc ^ tmp ^ CRC_TABLE[byte & 0xF]
+        tmp = CRC_TABLE[crc & 0xF]
+        crc = (crc >> 4) & 0x0FFF
+        crc = crc ^ tmp ^ CRC_TABLE[(byte >> 4) & 0xF]
+    return crc
+
+
+@lru_cache(maxsize=None)
+def crc_zero_operator(exponent: int) -> Tuple[int, ...]:
+    """
+    Return where each of the 16 CRC state bits ends up after feeding
+    2**exponent zero bytes.
+    """
+    if exponent == 0:
+        return tuple(fit_crc(b"\x00", 1 << bit) for bit in range(16))
+    half = crc_zero_operator(exponent - 1)
+    return tuple(apply_crc_operator(half, image) for image in half)
+
+
+def apply_crc_operator(operator: Tuple[int, ...], crc: int) -> int:
+    """Apply a linear operator from crc_zero_operator to a CRC state."""
+    result = 0
+    for bit in range(16):
+        if crc >> bit & 1:
+            result ^= operator[bit]
+    return result
+
+
+def fit_crc_combine(crc_a: int, crc_b: int, length_b: int) -> int:
+    """
+    Return the FIT CRC of A + B from the CRC of A, the CRC of B and the
+    length of B.
+
+    The CRC update is linear in its state, so only the CRC of A has to be
+    carried through length_b zero bytes, which takes O(log length_b)
+    steps instead of reading B again.
+    """
+    exponent = 0
+    while length_b:
+        if length_b & 1:
+            crc_a = apply_crc_operator(crc_zero_operator(exponent), crc_a)
+        length_b >>= 1
+        exponent += 1
+    return crc_a ^ crc_b
+
+
+class FitDefinition(NamedTuple):
+    """A parsed definition message and its raw bytes."""
+
+    local_type: int
+    global_number: int
+    little_endian: bool
+    # (field definition number, size, base type) per field.
+    fields: Tuple[Tuple[int, int, int], ...]
+    # (field number, size, developer data index) per developer field.
+    developer_fields: Tuple[Tuple[int, int, int], ...]
+    raw: bytes
+
+    @property
+    def data_size(self) -> int:
+        """Size of a data message using this definition, without header."""
+        return (sum(size for _, size, _ in self.fields)
+                + sum(size for _, size, _ in self.developer_fields))
+
+    def with_fields(self, fields: Sequence[Tuple[int, int, int]]
+                    ) -> "FitDefinition":
+        """Return a copy of this definition with a different field list."""
+        return make_definition(self.local_type, self.global_number,
+                               self.little_endian, fields,
+                               self.developer_fields)
+
+
+def make_definition(local_type: int, global_number: int,
+                    little_endian: bool,
+                    fields: Sequence[Tuple[int, int, int]],
+                    developer_fields: Sequence[Tuple[int, int, int]] = ()
+                    ) -> FitDefinition:
+    """Build a definition message, including its raw bytes."""
+    header = DEFINITION_HEADER | local_type
+    if developer_fields:
+        header |= DEVELOPER_DATA_HEADER
+    raw = bytearray((header, 0, 0 if little_endian else 1))
+    raw += struct.pack("<H" if little_endian else ">H", global_number)
+    raw.append(len(fields))
+    for field in fields:
+        raw += bytes(field)
+    if developer_fields:
+        raw.append(len(developer_fields))
+        for field in developer_fields:
+            raw += bytes(field)
+    return FitDefinition(
+        local_type=local_type,
+        global_number=global_number,
+        little_endian=little_endian,
+        fields=tuple(fields),
+        developer_fields=tuple(developer_fields),
+        raw=bytes(raw),
+    )
+
+
+def parse_fit_header(data: bytes) -> Tuple[int, int]:
+    """
+    Parse the FIT file header.
+
+    Returns:
+        tuple: The header size and the size of the data section.
+
+    Raises:
+        ValueError: If the data does not start with a FIT header.
+    """
+    if len(data) < 12 or data[8:12] != FIT_SIGNATURE:
+        raise ValueError("Not a FIT file.")
+    header_size = data[0]
+    (data_size,) = struct.unpack_from("<I", data, 4)
+    return header_size, data_size
+
+
+def definition_length(data: bytes, offset: int, end: int) -> Optional[int]:
+    """
+    Return the size of the definition message starting at offset, or None
+    if it does not fit before end.
+    """
+    if offset + 6 > end:
+        return None
+    length = 6 + data[offset + 5] * 3
+    if data[offset] & DEVELOPER_DATA_HEADER:
+        if offset + length + 1 > end:
+            return None
+        length += 1 + data[offset + length] * 3
+    return length if offset + length <= end else None
+
+
+def parse_definition(data: bytes, offset: int) -> FitDefinition:
+    """Parse the definition message starting at offset."""
+    if definition_length(data, offset, len(data)) is None:
+        raise ValueError(f"Truncated definition message at byte {offset}.")
+    header = data[offset]
+    little_endian = data[offset + 2] == 0
+    (global_number,) = struct.unpack_from("<H" if little_endian else ">H",
+                                          data, offset + 3)
+    num_fields = data[offset + 5]
+    pos = offset + 6
+    fields = tuple(
+        (data[pos + i * 3], data[pos + i * 3 + 1], data[pos + i * 3 + 2])
+        for i in range(num_fields)
+    )
+    pos += num_fields * 3
+    developer_fields = ()
+    if header & DEVELOPER_DATA_HEADER:
+        num_developer_fields = data[pos]
+        pos += 1
+        developer_fields = tuple(
+            (data[pos + i * 3], data[pos + i * 3 + 1], data[pos + i * 3 + 2])
+            for i in range(num_developer_fields)
+        )
+        pos += num_developer_fields * 3
+    return FitDefinition(
+        local_type=header & LOCAL_TYPE_MASK,
+        global_number=global_number,
+        little_endian=little_endian,
+        fields=fields,
+        developer_fields=developer_fields,
+        raw=bytes(data[offset:pos]),
+    )
+
+
+def build_fit_header(data_size: int, template_header: bytes) -> bytes:
+    """
+    Build a 14 byte FIT header for a data section of data_size bytes.
+
+    The protocol and profile versions are copied from template_header.
+    """
+    header = bytearray(FIT_HEADER_SIZE)
+    header[0] = FIT_HEADER_SIZE
+    header[1:4] = template_header[1:4]
+    struct.pack_into("<I", header, 4, data_size)
+    header[8:12] = FIT_SIGNATURE
+    struct.pack_into("<H", header, 12, fit_crc(header[:12]))
+    return bytes(header)
+
+
+def build_fit_file(body: bytes, template_header: bytes) -> bytes:
+    """
+    Wrap a data section in a 14 byte FIT header and a trailing CRC.
+
+    The protocol and profile versions are copied from template_header.
+    """
+    content = build_fit_header(len(body), template_header) + body
+    return content + struct.pack("<H", fit_crc(content))
+
+
+class FitColumns(NamedTuple):
+    """A run of consecutive data messages sharing one definition."""
+
+    definition: FitDefinition
+    # Structured array with one row per message; the "header" column
+    # holds each message's record header byte.
+    values: np.ndarray
+
+
+class FitColumnarFile(NamedTuple):
+    """A FIT file as definitions and column runs, in file order."""
+
+    header: bytes
+    segments: List[Union[FitDefinition, FitColumns]]
+
+
+def field_name(global_number: int, number: int) -> str:
+    """Return the profile name of a field, or field_<number>."""
+    return FIELD_NAMES.get(global_number, {}).get(number, f"field_{number}")
+
+
+@lru_cache(maxsize=None)
+def definition_layout(definition: FitDefinition
+                      ) -> Tuple[np.dtype, Dict[str, int]]:
+    """
+    Build the structured dtype of the data messages of a definition.
+
+    Returns:
+        tuple: The dtype (header byte first, then one column per field)
+        and the base type of each field column.
+    """
+    order = "<" if definition.little_endian else ">"
+    names, formats = ["header"], ["u1"]
+    base_types = {}
+    for number, size, base_type in definition.fields:
+        name = field_name(definition.global_number, number)
+        while name in base_types:
+            name += "_"
+        item = BASE_TYPES.get(base_type)
+        item = np.dtype(order + item[0]) if item else None
+        if item is None or size % item.itemsize:
+            formats.append(f"V{size}")
+        elif size == item.itemsize:
+            formats.append(item)
+        else:
+            formats.append((item, (size // item.itemsize,)))
+        names.append(name)
+        base_types[name] = base_type
+    for number, size, developer_index in definition.developer_fields:
+        names.append(f"developer_{developer_index}_{number}")
+        formats.append(f"V{size}")
+    return np.dtype({"names": names, "formats": formats}), base_types
+
+
+def decode_fit_columns(data: bytes) -> FitColumnarFile:
+    """
+    Decode a FIT file into definitions and column runs.
+
+    Consecutive data messages of the same definition are found with a
+    strided comparison of their header bytes and decoded with a single
+    np.frombuffer call, so Python work scales with the number of runs
+    rather than the number of messages.
+
+    The columns are views on data, nothing is copied, so decoding is not
+    split across worker processes: a six hour ride decodes in well under
+    a millisecond, less than it takes to start a process pool.
+
+    Raises:
+        ValueError: If the file is not a FIT file or is malformed.
+    """
+    header_size, data_size = parse_fit_header(data)
+    data_end = header_size + data_size
+    if len(data) < data_end:
+        raise ValueError("Truncated FIT file.")
+    segments, _ = decode_column_segments(data, header_size, data_end, {})
+    return FitColumnarFile(bytes(data[:header_size]), segments)
+
+
+def decode_column_segments(data: bytes, offset: int, end: int,
+                           active: Dict[int, FitDefinition],
+                           partial: bool = False
+                           ) -> Tuple[List[Union[FitDefinition, FitColumns]],
+                                      int]:
+    """
+    Decode the definitions and column runs in data[offset:end].
+
+    Args:
+        data (bytes): The FIT file contents, or a slice of them.
+        offset (int): Where the first message starts.
+        end (int): Where the data section (or the known part of it) ends.
+        active (dict): Definitions by local type, updated in place.
+        partial (bool): Stop at a message that is cut off by end instead
+            of raising, for files that are still being written.
+
+    Returns:
+        tuple: The segments and the offset after the last complete message.
+
+    Raises:
+        ValueError: If the data is malformed.
+    """
+    raw = np.frombuffer(data, dtype=np.uint8, count=end)
+    segments: List[Union[FitDefinition, FitColumns]] = []
+    while offset < end:
+        header = data[offset]
+        if header & COMPRESSED_TIMESTAMP_HEADER:
+            local_type = (header >> 5) & 0x03
+            mask = 0xE0
+        elif header & DEFINITION_HEADER:
+            if definition_length(data, offset, end) is None:
+                if partial:
+                    break
+                raise ValueError("Truncated definition message at byte "
+                                 f"{offset}.")
+            definition = parse_definition(data, offset)
+            active[definition.local_type] = definition
+            segments.append(definition)
+            offset += len(definition.raw)
+            continue
+        else:
+            local_type = header & LOCAL_TYPE_MASK
+            mask = 0xFF
+        definition = active.get(local_type)
+        if definition is None:
+            raise ValueError(f"Data message at byte {offset} uses "
+                             f"undefined local type {local_type}.")
+        stride = 1 + definition.data_size
+        run_end = offset + (end - offset) // stride * stride
+        if run_end == offset:
+            if partial:
+                break
+            raise ValueError("Last message runs past the end of the data.")
+        headers = raw[offset:run_end:stride]
+        same = (headers & mask) == (header & mask)
+        count = len(same) if same.all() else int(np.argmin(same))
+        dtype, _ = definition_layout(definition)
+        values = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        segments.append(FitColumns(definition, values))
+        offset += count * stride
+    return segments, offset
+
+
+class FitStreamDecoder:
+    """
+    Incrementally decodes a FIT file that is still being written.
+
+    Bytes are fed as they are appended to the file and only complete
+    messages are decoded; a message that is cut off is kept until the
+    rest of it arrives. While the final size of the data section is not
+    known, the last two bytes are also held back, since they may turn out
+    to be the file CRC rather than the start of a message.
+    """
+
+    def __init__(self):
+        self.header: Optional[bytes] = None
+        # File offset of the first byte in pending.
+        self.position = 0
+        self.pending = b""
+        self.active: Dict[int, FitDefinition] = {}
+
+    def feed(self, data: bytes, data_end: Optional[int] = None
+             ) -> List[Union[FitDefinition, FitColumns]]:
+        """
+        Decode the messages completed by newly appended bytes.
+
+        Args:
+            data (bytes): The bytes appended since the last call.
+            data_end (int, optional): The file offset where the data
+                section ends, once the file header says so.
+
+        Returns:
+            list: The definitions and column runs decoded by this call.
+
+        Raises:
+            ValueError: If the file is not a FIT file or is malformed.
+        """
+        self.pending += data
+        if self.header is None:
+            if len(self.pending) < 12:
+                return []
+            header_size, _ = parse_fit_header(self.pending)
+            if len(self.pending) < header_size:
+                return []
+            self.header = self.pending[:header_size]
+            self.pending = self.pending[header_size:]
+            self.position = header_size
+        available = len(self.pending)
+        if data_end is None:
+            end = max(available - 2, 0)
+        else:
+            end = min(max(data_end - self.position, 0), available)
+        partial = data_end is None or self.position + available < data_end
+        segments, offset = decode_column_segments(
+            self.pending, 0, end, self.active, partial
+        )
+        self.pending = self.pending[offset:]
+        self.position += offset
+        return segments
+
+    def finished(self, data_end: int) -> bool:
+        """Return True once every message before data_end is decoded."""
+        return self.header is not None and self.position >= data_end
+
+
+def encode_fit_columns(fit: FitColumnarFile) -> bytes:
+    """Encode definitions and column runs into a complete FIT file."""
+    return build_fit_file(encode_column_segments(fit.segments), fit.header)
+
+
+def encode_column_segments(
+        segments: Sequence[Union[FitDefinition, FitColumns]]) -> bytes:
+    """Encode definitions and column runs into data section bytes."""
+    return b"".join(
+        segment.raw if isinstance(segment, FitDefinition)
+        else segment.values.tobytes()
+        for segment in segments
+    )
+
+
+def project_columns(values: np.ndarray,
+                    definition: FitDefinition) -> np.ndarray:
+    """
+    Copy a run into the layout of another definition.
+
+    Columns that exist in both layouts are copied as whole arrays, new
+    columns are filled with their invalid value and missing ones dropped.
+    """
+    dtype, base_types = definition_layout(definition)
+    projected = np.frombuffer(b"\xff" * (dtype.itemsize * len(values)),
+                              dtype=dtype).copy()
+    for name in dtype.names:
+        if name in values.dtype.names:
+            projected[name] = values[name]
+        elif base_types.get(name) in ZERO_INVALID_BASE_TYPES:
+            projected[name] = np.zeros(1, dtype[name])
+    return projected
+
+
+def field_values(run: FitColumns, name: str) -> np.ndarray:
+    """
+    Return a numeric field of a run with invalid values replaced by 0.
+
+    Fields missing from the run's definition read as all zeros.
+    """
+    if name not in run.values.dtype.names:
+        return np.zeros(len(run.values), dtype=np.int64)
+    column = run.values[name]
+    if column.dtype.kind == "f":
+        return np.where(np.isnan(column), 0, column)
+    _, base_types = definition_layout(run.definition)
+    invalid = BASE_TYPES[base_types[name]][1]
+    return np.where(column == invalid, 0, column).astype(np.int64)
+
+
+class FieldTransform(NamedTuple):
+    """
+    One field transform rule. Values are raw FIT values, before the
+    profile's scale and offset (e.g. distance in centimetres).
+    """
+
+    message: int
+    field: int
+    action: str
+    to: Optional[int] = None
+    factor: float = 1.0
+    offset: float = 0.0
+    minimum: Optional[float] = None
+    maximum: Optional[float] = None
+
+
+class TransformPlan(NamedTuple):
+    """Field transforms compiled for one definition."""
+
+    definition: FitDefinition
+    # (input column, output column) pairs to copy.
+    columns: Tuple[Tuple[str, str], ...]
+    # (output column, rule) pairs of scale and clamp rules.
+    operations: Tuple[Tuple[str, FieldTransform], ...]
+    identity: bool
+
+
+def resolve_message_number(message: Union[str, int]) -> int:
+    """Return the global message number of a message name or number."""
+    if isinstance(message, int):
+        return message
+    if message not in MESSAGE_NUMBERS:
+        raise ValueError(f"Unknown message: {message}")
+    return MESSAGE_NUMBERS[message]
+
+
+def resolve_field_number(message: int, field: Union[str, int]) -> int:
+    """Return the field number of a field name, field_<n> or number."""
+    if isinstance(field, int):
+        return field
+    for number, name in FIELD_NAMES.get(message, {}).items():
+        if name == field:
+            return number
+    if field.startswith("field_") and field[6:].isdigit():
+        return int(field[6:])
+    raise ValueError(f"Unknown field {field} for message {message}")
+
+
+def parse_field_transforms(rules: Sequence[dict]
+                           ) -> Tuple[FieldTransform, ...]:
+    """
+    Parse transform rules such as
+    {"message": "record", "field": "temperature", "action": "drop"}.
+
+    Raises:
+        ValueError: If a rule is incomplete, refers to unknown names or
+            renames two fields of a message to the same field.
+    """
+    transforms = []
+    rename_targets = set()
+    for rule in rules:
+        try:
+            message = resolve_message_number(rule["message"])
+            field = resolve_field_number(message, rule["field"])
+            action = rule["action"]
+            to = (resolve_field_number(message, rule["to"])
+                  if action == "rename" else None)
+        except KeyError as e:
+            raise ValueError(f"Missing {e} in transform {rule}") from e
+        if action not in TRANSFORM_ACTIONS:
+            raise ValueError(f"Unknown transform action: {action}")
+        if to is not None:
+            if (message, to) in rename_targets:
+                raise ValueError(f"Two fields are renamed to {rule['to']} "
+                                 f"in message {message}")
+            rename_targets.add((message, to))
+        transforms.append(FieldTransform(
+            message=message,
+            field=field,
+            action=action,
+            to=to,
+            factor=float(rule.get("factor", 1.0)),
+            offset=float(rule.get("offset", 0.0)),
+            minimum=rule.get("min"),
+            maximum=rule.get("max"),
+        ))
+    return tuple(transforms)
+
+
+@lru_cache(maxsize=None)
+def compile_transform_plan(definition: FitDefinition,
+                           transforms: Tuple[FieldTransform, ...]
+                           ) -> TransformPlan:
+    """
+    Compile the transforms that apply to a definition into a plan.
+
+    Plans are cached, so each definition is compiled once and every data
+    message using it only pays for whole-column copies and operations.
+    A field renamed to a number the definition already has replaces that
+    field, so the output never defines a field number twice.
+    """
+    rules = [rule for rule in transforms
+             if rule.message == definition.global_number]
+    if not rules:
+        return TransformPlan(definition, (), (), True)
+    dropped = {rule.field for rule in rules if rule.action == "drop"}
+    renamed = {rule.field: rule.to for rule in rules
+               if rule.action == "rename"}
+    present = {number for number, _, _ in definition.fields}
+    moved_to = {to for number, to in renamed.items()
+                if number in present and number not in dropped}
+    dropped |= moved_to - renamed.keys()
+    in_dtype, _ = definition_layout(definition)
+    in_names = in_dtype.names[1:]
+    kept, out_fields = [], []
+    for (number, size, base_type), name in zip(definition.fields, in_names):
+        if number in dropped:
+            continue
+        kept.append((number, name))
+        out_fields.append((renamed.get(number, number), size, base_type))
+    output = definition.with_fields(out_fields)
+    out_dtype, _ = definition_layout(output)
+    out_names = out_dtype.names[1:]
+    out_name_by_number = {
+        number: out_name for (number, _), out_name in zip(kept, out_names)
+    }
+    columns = [("header", "header")]
+    columns += [(name, out_name)
+                for (_, name), out_name in zip(kept, out_names)]
+    columns += list(zip(in_names[len(definition.fields):],
+                        out_names[len(out_fields):]))
+    operations = tuple(
+        (out_name_by_number[rule.field], rule) for rule in rules
+        if rule.action in ("scale", "clamp")
+        and rule.field in out_name_by_number
+    )
+    return TransformPlan(output, tuple(columns), operations, False)
+
+
+def transform_column(column: np.ndarray, base_type: int,
+                     rule: FieldTransform) -> np.ndarray:
+    """Apply a scale or clamp rule to a column, keeping invalid values."""
+    if column.dtype.kind not in "iuf":
+        return column
+    if column.dtype.kind == "f":
+        valid = ~np.isnan(column)
+        low, high = -np.inf, np.inf
+    else:
+        invalid = BASE_TYPES[base_type][1]
+        valid = column != invalid
+        info = np.iinfo(column.dtype)
+        low = 1 if invalid == 0 else info.min
+        high = info.max - 1 if invalid == info.max else info.max
+    result = column.astype(np.float64)
+    if rule.action == "scale":
+        result = result * rule.factor + rule.offset
+    else:
+        result = np.clip(
+            result,
+            -np.inf if rule.minimum is None else rule.minimum,
+            np.inf if rule.maximum is None else rule.maximum,
+        )
+    if column.dtype.kind != "f":
+        result = np.round(result)
+    result = np.clip(result, low, high).astype(column.dtype)
+    return np.where(valid, result, column)
+
+
+def transform_value(value: float, rule: FieldTransform) -> float:
+    """Apply a scale or clamp rule to a single raw value."""
+    if rule.action == "scale":
+        return value * rule.factor + rule.offset
+    if rule.minimum is not None:
+        value = max(value, rule.minimum)
+    if rule.maximum is not None:
+        value = min(value, rule.maximum)
+    return value
+
+
+def apply_transform_plan(plan: TransformPlan,
+                         values: np.ndarray) -> np.ndarray:
+    """Apply a compiled plan to a run of data messages."""
+    if plan.identity:
+        return values
+    dtype, base_types = definition_layout(plan.definition)
+    transformed = np.empty(len(values), dtype)
+    for in_name, out_name in plan.columns:
+        transformed[out_name] = values[in_name]
+    for name, rule in plan.operations:
+        transformed[name] = transform_column(transformed[name],
+                                             base_types[name], rule)
+    return transformed
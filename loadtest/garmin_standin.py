@@ -0,0 +1,274 @@
+"""
+Local stand-in for the Garmin Connect endpoints used by garth.
+
+Mimics the SSO login, OAuth1/OAuth2 token and upload endpoints closely
+enough for garth to log in and upload, and can inject latency, 429
+throttling, 409 duplicates and transient 5xx errors.
+
+Usage: "python3 garmin_standin.py --port 8765 --throttle-rate 0.1"
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Set
+from urllib.parse import urlsplit
+
+
+@dataclass
+class StandinConfig:
+    """Fault injection settings for the stand-in server."""
+
+    latency: float = 0.05
+    jitter: float = 0.02
+    throttle_rate: float = 0.0
+    error_rate: float = 0.0
+    retry_after: int = 1
+    token_ttl: int = 3600
+    seed: int = 0
+
+
+@dataclass
+class StandinStats:
+    """Counters for the responses the stand-in server has sent."""
+
+    logins: int = 0
+    token_exchanges: int = 0
+    uploads: int = 0
+    duplicates: int = 0
+    throttled: int = 0
+    errors: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock,
+                                 repr=False)
+
+    def incr(self, name: str):
+        """Increment a counter."""
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self) -> Dict[str, int]:
+        """Return the counters as a plain dictionary."""
+        with self.lock:
+            return {name: getattr(self, name) for name in (
+                "logins", "token_exchanges", "uploads", "duplicates",
+                "throttled", "errors"
+            )}
+
+
+class GarminStandinServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the stand-in state."""
+
+    daemon_threads = True
+
+    def __init__(self, address, config: StandinConfig):
+        super().__init__(address, GarminStandinHandler)
+        self.config = config
+        self.stats = StandinStats()
+        self.random = random.Random(config.seed)
+        self.random_lock = threading.Lock()
+        self.uploaded: Set[str] = set()
+        self.uploaded_lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def roll(self) -> float:
+        """Return a random number in [0, 1) from the seeded generator."""
+        with self.random_lock:
+            return self.random.random()
+
+    def delay(self):
+        """Sleep for the configured latency plus jitter."""
+        jitter = (self.roll() * 2 - 1) * self.config.jitter
+        time.sleep(max(self.config.latency + jitter, 0))
+
+    def register_upload(self, content: bytes) -> bool:
+        """Remember an uploaded file, returning False for duplicates."""
+        digest = hashlib.sha256(content).hexdigest()
+        with self.uploaded_lock:
+            if digest in self.uploaded:
+                return False
+            self.uploaded.add(digest)
+            return True
+
+
+def extract_multipart_file(body: bytes, content_type: str) -> bytes:
+    """Return the content of the "file" part of a multipart body."""
+    match = re.search(r'boundary="?([^";]+)"?', content_type)
+    if not match:
+        return body
+    boundary = b"--" + match.group(1).encode()
+    for part in body.split(boundary):
+        headers, _, content = part.partition(b"\r\n\r\n")
+        if b'name="file"' in headers:
+            return content[:-2] if content.endswith(b"\r\n") else content
+    return b""
+
+
+class GarminStandinHandler(BaseHTTPRequestHandler):
+    """Request handler for the SSO, OAuth and upload endpoints."""
+
+    protocol_version = "HTTP/1.1"
+    server: GarminStandinServer
+
+    def log_message(self, format, *args):
+        """Keep the load-test output quiet."""
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status: int, body, content_type: str = "application/json",
+              headers: Dict[str, str] = None):
+        if not isinstance(body, (bytes, str)):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        self._read_body()
+        if path == "/sso/embed":
+            self._send(200, "<html><body>embed</body></html>", "text/html")
+        elif path == "/sso/signin":
+            self._send(200, (
+                "<html><head><title>GARMIN Authentication</title></head>"
+                '<body><input type="hidden" name="_csrf" '
+                'value="standin-csrf"/></body></html>'
+            ), "text/html")
+        elif path == "/oauth-service/oauth/preauthorized":
+            self._send(200, "oauth_token=standin-oauth1-token"
+                       "&oauth_token_secret=standin-oauth1-secret",
+                       "text/plain")
+        elif path == "/userprofile-service/socialProfile":
+            self._send(200, {"userName": "standin-rider",
+                             "displayName": "standin-rider"})
+        else:
+            self._send(404, {"message": f"Unknown path {path}"})
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        body = self._read_body()
+        if path == "/sso/signin":
+            self.server.stats.incr("logins")
+            self._send(200, (
+                "<html><head><title>Success</title></head><body>"
+                '<script>var url = "https://sso.garmin.com/sso/'
+                'embed?ticket=ST-standin-ticket";</script></body></html>'
+            ), "text/html")
+        elif path == "/oauth-service/oauth/exchange/user/2.0":
+            self.server.stats.incr("token_exchanges")
+            self._send(200, {
+                "scope": "CONNECT_READ CONNECT_WRITE",
+                "jti": f"standin-{time.time_ns()}",
+                "token_type": "Bearer",
+                "access_token": f"standin-access-{time.time_ns()}",
+                "refresh_token": "standin-refresh",
+                "expires_in": self.server.config.token_ttl,
+                "refresh_token_expires_in": 30 * 24 * 3600,
+            })
+        elif path == "/upload-service/upload":
+            self._upload(body)
+        else:
+            self._send(404, {"message": f"Unknown path {path}"})
+
+    def _upload(self, body: bytes):
+        config = self.server.config
+        self.server.delay()
+        if self.server.roll() < config.throttle_rate:
+            self.server.stats.incr("throttled")
+            self._send(429, {"message": "Too Many Requests"},
+                       headers={"Retry-After": str(config.retry_after)})
+            return
+        if self.server.roll() < config.error_rate:
+            self.server.stats.incr("errors")
+            self._send(503, {"message": "Service Unavailable"})
+            return
+        content = extract_multipart_file(
+            body, self.headers.get("Content-Type", "")
+        )
+        if not self.server.register_upload(content):
+            self.server.stats.incr("duplicates")
+            self._send(409, {"detailedImportResult": {
+                "failures": [{"messages": [
+                    {"code": 202, "content": "Duplicate Activity."}
+                ]}]
+            }})
+            return
+        self.server.stats.incr("uploads")
+        self._send(201, {"detailedImportResult": {
+            "uploadId": time.time_ns(), "successes": [], "failures": []
+        }})
+
+
+def start_server(config: StandinConfig, host: str = "127.0.0.1",
+                 port: int = 0) -> GarminStandinServer:
+    """Start the stand-in server on a background thread."""
+    server = GarminStandinServer((host, port), config)
+    thread = threading.Thread(target=server.serve_forever,
+                              name="garmin-standin", daemon=True)
+    thread.start()
+    return server
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    """Add the fault injection options to an argument parser."""
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Upload latency in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.02,
+                        help="Random +/- latency jitter in seconds.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="Fraction of uploads answered with 429.")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of uploads answered with 503.")
+    parser.add_argument("--retry-after", type=int, default=1,
+                        help="Retry-After seconds sent with 429s.")
+    parser.add_argument("--token-ttl", type=int, default=3600,
+                        help="Lifetime of issued OAuth2 tokens in seconds.")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed for the fault injection.")
+
+
+def config_from_args(args: argparse.Namespace) -> StandinConfig:
+    """Build a StandinConfig from parsed arguments."""
+    return StandinConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        throttle_rate=args.throttle_rate,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        token_ttl=args.token_ttl,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    server = GarminStandinServer((args.host, args.port),
+                                 config_from_args(args))
+    print(f"Garmin stand-in listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.stats.as_dict(), indent=2))
+        server.server_close()
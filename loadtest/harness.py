@@ -0,0 +1,275 @@
+"""
+End-to-end load test of myWhoosh2Garmin against the Garmin stand-in.
+
+Loads a private copy of myWhoosh2Garmin.py inside a temporary home
+directory, routes garth's HTTPS traffic to the local stand-in server and
+pushes synthetic rides through cleanup, the upload outbox and the upload
+drainers. Reports end-to-end files/s and latency percentiles.
+
+Usage: "python3 harness.py --files 200 --workers 4 --throttle-rate 0.1"
+"""
+import argparse
+import importlib.util
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import ModuleType
+from typing import Dict, List
+from urllib.parse import urlsplit, urlunsplit
+
+import garth
+from fit_tool.fit_file_builder import FitFileBuilder
+from fit_tool.profile.messages.file_id_message import FileIdMessage
+from fit_tool.profile.messages.lap_message import LapMessage
+from fit_tool.profile.messages.record_message import RecordMessage
+from fit_tool.profile.messages.session_message import SessionMessage
+from fit_tool.profile.profile_type import FileType, Manufacturer, Sport
+from requests.adapters import HTTPAdapter
+
+from garmin_standin import add_config_arguments, config_from_args, start_server
+
+
+SCRIPT_PATH = Path(__file__).resolve().parent.parent / "myWhoosh2Garmin.py"
+MACOS_DATA_DIR = Path(
+    "Library", "Containers", "com.whoosh.whooshgame", "Data", "Library",
+    "Application Support", "Epic", "MyWhoosh", "Content", "Data"
+)
+WINDOWS_DATA_DIR = Path(
+    "AppData", "Local", "Packages", "MyWhooshTechnologyService.standin",
+    "LocalCache", "Local", "MyWhoosh", "Content", "Data"
+)
+
+
+class StandinAdapter(HTTPAdapter):
+    """Transport adapter that sends garth's HTTPS requests to the stand-in."""
+
+    def __init__(self, base_url: str, **kwargs):
+        self.netloc = urlsplit(base_url).netloc
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        request.headers["X-Forwarded-Host"] = url.netloc
+        request.url = urlunsplit(
+            ("http", self.netloc, url.path, url.query, "")
+        )
+        return super().send(request, **kwargs)
+
+
+def route_garth_to(base_url: str, pool_size: int):
+    """Send all garth traffic to the stand-in, keeping its retry policy."""
+    client = garth.client
+    configure = type(client).configure
+
+    def mount_standin():
+        current = client.sess.adapters.get("https://")
+        client.sess.mount("https://", StandinAdapter(
+            base_url,
+            max_retries=getattr(current, "max_retries", 0),
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+        ))
+
+    # garth mounts a fresh adapter whenever it is configured, e.g. when
+    # tokens are resumed from disk.
+    def configure_and_route(*args, **kwargs):
+        configure(client, *args, **kwargs)
+        mount_standin()
+
+    client.configure = configure_and_route
+    mount_standin()
+    # garth downloads its OAuth consumer from S3 unless it is already set.
+    consumer = getattr(garth.sso, "OAUTH_CONSUMER", None)
+    if consumer is not None:
+        consumer.update(consumer_key="standin", consumer_secret="standin")
+
+
+def load_pipeline(sandbox: Path) -> ModuleType:
+    """
+    Import a copy of myWhoosh2Garmin.py that lives in a sandbox.
+
+    The copy finds its MyWhoosh folder, backup folder, tokens, log and
+    outbox inside the sandbox instead of the rider's real setup.
+    """
+    home = sandbox / "home"
+    for data_dir in (MACOS_DATA_DIR, WINDOWS_DATA_DIR):
+        (home / data_dir).mkdir(parents=True)
+    backup_dir = sandbox / "backup"
+    backup_dir.mkdir()
+    with open(sandbox / "backup_path.json", "w") as f:
+        json.dump({"backup_path": str(backup_dir)}, f)
+    os.environ["HOME"] = str(home)
+    os.environ["USERPROFILE"] = str(home)
+
+    # The copy imports its helper modules from the repository root.
+    sys.path.insert(0, str(SCRIPT_PATH.parent))
+    script_copy = sandbox / SCRIPT_PATH.name
+    shutil.copy(SCRIPT_PATH, script_copy)
+    spec = importlib.util.spec_from_file_location("myWhoosh2Garmin",
+                                                  script_copy)
+    pipeline = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(pipeline)
+    pipeline.load_settings()
+    return pipeline
+
+
+def write_synthetic_ride(path: Path, start: datetime, seconds: int,
+                         rng: random.Random):
+    """Write a MyWhoosh-like ride without power/HR/cadence averages."""
+    start_ms = int(start.timestamp() * 1000)
+    end_ms = start_ms + seconds * 1000
+    builder = FitFileBuilder(auto_define=True, min_string_size=50)
+
+    file_id = FileIdMessage()
+    file_id.type = FileType.ACTIVITY
+    file_id.manufacturer = Manufacturer.DEVELOPMENT.value
+    file_id.product = 0
+    file_id.serial_number = 0x12345678
+    file_id.time_created = start_ms
+    builder.add(file_id)
+
+    for second in range(seconds):
+        record = RecordMessage()
+        record.timestamp = start_ms + second * 1000
+        record.power = rng.randint(150, 300)
+        record.heart_rate = rng.randint(120, 170)
+        record.cadence = rng.randint(80, 100)
+        record.distance = second * 9.0
+        record.temperature = 20
+        builder.add(record)
+
+    lap = LapMessage()
+    lap.timestamp = end_ms
+    lap.start_time = start_ms
+    lap.total_elapsed_time = seconds
+    lap.total_timer_time = seconds
+    builder.add(lap)
+
+    session = SessionMessage()
+    session.timestamp = end_ms
+    session.start_time = start_ms
+    session.total_elapsed_time = seconds
+    session.total_timer_time = seconds
+    session.sport = Sport.CYCLING
+    builder.add(session)
+
+    builder.build().to_file(str(path))
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Return the nearest-rank percentile of a list of values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def run(args: argparse.Namespace) -> Dict[str, object]:
+    """Run the load test and return its report."""
+    server = start_server(config_from_args(args))
+    sandbox = Path(tempfile.mkdtemp(prefix="mw2g-loadtest-"))
+    try:
+        pipeline = load_pipeline(sandbox)
+        pipeline.OUTBOX_BACKOFF_BASE = args.backoff_base
+        pipeline.OUTBOX_BACKOFF_MAX = args.backoff_max
+        route_garth_to(server.base_url, args.workers)
+        garth.login("rider@example.com", "standin")
+        garth.save(pipeline.TOKENS_PATH)
+        pipeline.authenticate_to_garmin()
+
+        outbox = pipeline.UploadOutbox(pipeline.OUTBOX_PATH)
+        drainers = [
+            pipeline.OutboxDrainer(outbox, stop_when_idle=False,
+                                   poll_interval=0.05)
+            for _ in range(args.workers)
+        ]
+        for drainer in drainers:
+            drainer.start()
+
+        rng = random.Random(args.seed)
+        source = pipeline.FITFILE_LOCATION / "MyNewActivity-9.9.9.fit"
+        ride_start = datetime(2024, 1, 1, 6, tzinfo=timezone.utc)
+        started: Dict[str, float] = {}
+        produced: List[Path] = []
+        for i in range(args.files):
+            new_file_path = pipeline.BACKUP_FITFILE_LOCATION / f"ride_{i:05d}.fit"
+            if produced and rng.random() < args.duplicate_rate:
+                begin = time.time()
+                shutil.copy(rng.choice(produced), new_file_path)
+            else:
+                write_synthetic_ride(source, ride_start + timedelta(hours=i),
+                                     args.ride_seconds, rng)
+                begin = time.time()
+                pipeline.cleanup_fit_file(source, new_file_path)
+                produced.append(new_file_path)
+            started[str(new_file_path)] = begin
+            outbox.enqueue(new_file_path)
+
+        deadline = time.time() + args.timeout
+        while outbox.pending_count() and time.time() < deadline:
+            time.sleep(0.05)
+        for drainer in drainers:
+            drainer.stop()
+        for drainer in drainers:
+            drainer.join()
+
+        with outbox.lock:
+            rows = outbox.conn.execute(
+                "SELECT file_path, attempts, finished_at FROM outbox "
+                "WHERE status = 'done'"
+            ).fetchall()
+        outbox.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(sandbox, ignore_errors=True)
+
+    latencies = [finished_at - started[file_path]
+                 for file_path, _, finished_at in rows]
+    first_start = min(started.values())
+    last_finish = max((row[2] for row in rows), default=first_start)
+    elapsed = max(last_finish - first_start, 1e-9)
+    return {
+        "files_queued": args.files,
+        "files_done": len(rows),
+        "retries": sum(attempts for _, attempts, _ in rows),
+        "elapsed_s": round(elapsed, 3),
+        "files_per_s": round(len(rows) / elapsed, 2),
+        "latency_s": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "max": round(max(latencies, default=0.0), 3),
+        },
+        "server": server.stats.as_dict(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=50,
+                        help="Number of rides to push through the pipeline.")
+    parser.add_argument("--ride-seconds", type=int, default=3600,
+                        help="Length of each synthetic ride (1 Hz records).")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of concurrent outbox drainers.")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0,
+                        help="Fraction of files re-sent as duplicates.")
+    parser.add_argument("--backoff-base", type=float, default=0.2,
+                        help="Outbox retry backoff base in seconds.")
+    parser.add_argument("--backoff-max", type=float, default=5.0,
+                        help="Outbox retry backoff cap in seconds.")
+    parser.add_argument("--timeout", type=float, default=300.0,
+                        help="Give up waiting for uploads after this long.")
+    add_config_arguments(parser)
+    report = run(parser.parse_args())
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["files_done"] == report["files_queued"] else 1)
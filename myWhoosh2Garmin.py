@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
 """
 Script name: myWhoosh2Garmin.py
-Usage: "python3 myWhoosh2Garmin.py"
+Usage: "python3 myWhoosh2Garmin.py [--serve | --trigger | --live]"
 Description:    Checks for MyNewActivity-<myWhooshVersion>.fit
                 Adds avg power and heartrade
-                Removes temperature
+                Removes temperature (configurable field transforms)
                 Creates backup for the file with a timestamp as a suffix
+                Queues the file in an outbox and retries failed uploads
 Credits:        Garth by matin - for authenticating and uploading with 
                 Garmin Connect.
                 https://github.com/matin/garth
@@ -14,17 +15,25 @@ Credits:        Garth by matin - for authenticating and uploading with
                 mw2gc by embeddedc - used as an example to fix the avg's. 
                 https://github.com/embeddedc/mw2gc
 """
+import argparse
 import os
 import json
+import random
+import sqlite3
+import struct
 import subprocess
 import sys
 import logging
 import re
-from typing import List
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
 import tkinter as tk
 from tkinter import filedialog
 from datetime import datetime
+from email.utils import parsedate_to_datetime
 from getpass import getpass
+from multiprocessing.connection import AuthenticationError, Client, Listener
 from pathlib import Path
 import importlib.util
 
@@ -41,6 +50,47 @@ logger.addHandler(file_handler)
 
 
 INSTALLED_PACKAGES_FILE = SCRIPT_DIR / "installed_packages.json"
+DAEMON_KEY_PATH = SCRIPT_DIR / ".daemon_key"
+if os.name == "nt":
+    DAEMON_ADDRESS = r"\\.\pipe\MyWhoosh2Garmin"
+else:
+    DAEMON_ADDRESS = str(SCRIPT_DIR / ".myWhoosh2Garmin.sock")
+
+
+def send_daemon_job(job: dict) -> Optional[dict]:
+    """
+    Send a job to a running daemon (--serve).
+
+    Only uses the standard library, so it can run before the heavy
+    imports below.
+
+    Returns:
+        dict or None: The daemon's reply, or None if none is running.
+    """
+    if not DAEMON_KEY_PATH.exists():
+        return None
+    try:
+        with Client(DAEMON_ADDRESS,
+                    authkey=DAEMON_KEY_PATH.read_bytes()) as conn:
+            conn.send(job)
+            return conn.recv()
+    except (OSError, EOFError, AuthenticationError) as e:
+        logger.info(f"No daemon reachable at {DAEMON_ADDRESS}: {e}.")
+        return None
+
+
+def trigger_daemon() -> bool:
+    """
+    Ask a running daemon (--serve) to process the most recent .fit file.
+
+    Returns:
+        bool: True if a daemon handled the job, False if none is running.
+    """
+    reply = send_daemon_job({"command": "process"})
+    if reply is None:
+        return False
+    logger.info(f"Daemon replied: {reply}")
+    return True
 
 
 def load_installed_packages():
@@ -87,7 +137,7 @@ def install_package(package):
 
 def ensure_packages():
     """Ensure all required packages are installed and tracked."""
-    required_packages = ["garth", "fit_tool"]
+    required_packages = ["garth", "fit_tool", "numpy"]
     installed_packages = load_installed_packages()
 
     for package in required_packages:
@@ -111,7 +161,12 @@ def ensure_packages():
     save_installed_packages(installed_packages)
 
 
-ensure_packages()
+# Only when run as a script: processes that merely import this module
+# must not run pip or rewrite installed_packages.json.
+if __name__ == "__main__":
+    if "--trigger" in sys.argv[1:] and trigger_daemon():
+        sys.exit(0)
+    ensure_packages()
 
 
 # Imports
@@ -123,12 +178,37 @@ try:
     from fit_tool.profile.messages.file_creator_message import (
         FileCreatorMessage
     )
-    from fit_tool.profile.messages.record_message import (
-        RecordMessage,
-        RecordTemperatureField
-    )
+    from fit_tool.data_message import DataMessage
+    from fit_tool.profile.messages.record_message import RecordMessage
     from fit_tool.profile.messages.session_message import SessionMessage
     from fit_tool.profile.messages.lap_message import LapMessage
+    from requests.exceptions import RequestException
+    import numpy as np
+    from activity_fingerprint import (
+        ActivityFingerprint,
+        FingerprintIndex,
+        fingerprint_fit_file,
+    )
+    from fit_codec import (
+        FitColumns,
+        FitDefinition,
+        FitStreamDecoder,
+        FieldTransform,
+        RECORD_MESSAGE,
+        SESSION_MESSAGE,
+        apply_transform_plan,
+        build_fit_header,
+        compile_transform_plan,
+        decode_fit_columns,
+        encode_column_segments,
+        field_values,
+        fit_crc,
+        fit_crc_combine,
+        parse_field_transforms,
+        parse_fit_header,
+        project_columns,
+        transform_value,
+    )
 except ImportError as e:
     logger.error(f"Error importing modules: {e}")
 
@@ -137,6 +217,35 @@ TOKENS_PATH = SCRIPT_DIR / '.garth'
 FILE_DIALOG_TITLE = "MyWhoosh2Garmin"
 # Fix for https://github.com/JayQueue/MyWhoosh2Garmin/issues/2
 MYWHOOSH_PREFIX_WINDOWS = "MyWhooshTechnologyService." 
+OUTBOX_PATH = SCRIPT_DIR / "outbox.db"
+# Retry delays for failed uploads: 30s, 60s, 120s, ... capped at one hour.
+OUTBOX_BACKOFF_BASE = 30
+OUTBOX_BACKOFF_MAX = 3600
+# How long a single run waits for queued uploads before leaving them for
+# the next run.
+OUTBOX_DRAIN_TIMEOUT = 120
+# An upload claimed longer ago than this belongs to a process that
+# crashed or hung, and may be taken over by another drainer.
+OUTBOX_LEASE_SECONDS = 600
+HTTP_CONFLICT = 409
+# Results of upload_fit_file_to_garmin.
+UPLOAD_CREATED = "created"
+UPLOAD_DUPLICATE = "duplicate"
+# Client errors that can succeed on a later attempt; any other 4xx means
+# Garmin Connect rejected the file itself.
+RETRYABLE_CLIENT_ERRORS = (401, 403, 408, 429)
+FIELD_TRANSFORMS_PATH = SCRIPT_DIR / "field_transforms.json"
+# Used when field_transforms.json does not exist. See README.md for the
+# rule format.
+DEFAULT_FIELD_TRANSFORMS = [
+    {"message": "record", "field": "temperature", "action": "drop"},
+]
+# Record fields whose averages are filled in on the session message.
+AVERAGED_FIELDS = ("cadence", "power", "heart_rate")
+# (field number, size, base type) of the session average fields.
+SESSION_AVERAGE_FIELDS = ((18, 1, 0x02), (20, 2, 0x84), (16, 1, 0x02))
+# How often --live checks the ride file for new data, in seconds.
+LIVE_POLL_INTERVAL = 1.0
 
 
 def get_fitfile_location() -> Path:
@@ -234,8 +343,54 @@ def get_backup_path(json_file=json_file_path) -> Path:
         logger.info(f"Backup path saved to {json_file}.")
     return Path(backup_path)
 
-FITFILE_LOCATION = get_fitfile_location()
-BACKUP_FITFILE_LOCATION = get_backup_path()
+def load_field_transforms(json_file: Path = FIELD_TRANSFORMS_PATH
+                          ) -> tuple[FieldTransform, ...]:
+    """
+    Load the field transform rules from a JSON file, or the default rules
+    if the file does not exist.
+
+    Args:
+        json_file (Path): Path to the JSON file with a "transforms" list.
+
+    Returns:
+        tuple: The parsed FieldTransform rules.
+
+    Exits:
+        Exits with status 1 if the rules are invalid.
+    """
+    rules = DEFAULT_FIELD_TRANSFORMS
+    if json_file.exists():
+        with open(json_file, 'r') as f:
+            rules = json.load(f).get("transforms", [])
+        logger.info(f"Using field transforms from {json_file}.")
+    try:
+        return parse_field_transforms(rules)
+    except ValueError as e:
+        logger.error(f"Invalid field transform: {e}.")
+        sys.exit(1)
+
+
+# Set by load_settings() when the script starts.
+FITFILE_LOCATION = Path()
+BACKUP_FITFILE_LOCATION = Path()
+FIELD_TRANSFORMS = ()
+
+
+def load_settings():
+    """
+    Locate the MyWhoosh and backup folders and load the field transforms.
+
+    Kept out of module import so that importing this module never opens
+    a folder dialog.
+
+    Returns:
+        None
+    """
+    global FITFILE_LOCATION, BACKUP_FITFILE_LOCATION, FIELD_TRANSFORMS
+    FITFILE_LOCATION = get_fitfile_location()
+    BACKUP_FITFILE_LOCATION = get_backup_path()
+    FIELD_TRANSFORMS = load_field_transforms()
+
 
 def get_credentials_for_garmin():
     """
@@ -329,10 +484,174 @@ def reset_values() -> tuple[List[int], List[int], List[int], List[int]]:
     return  [], [], [], []
 
 
-def cleanup_fit_file(fit_file_path: Path, new_file_path: Path) -> None:
+def add_average_fields(definition: FitDefinition) -> FitDefinition:
+    """Return a session definition with the average fields it is missing."""
+    if definition.global_number != SESSION_MESSAGE:
+        return definition
+    present = {number for number, _, _ in definition.fields}
+    return definition.with_fields(definition.fields + tuple(
+        field for field in SESSION_AVERAGE_FIELDS
+        if field[0] not in present
+    ))
+
+
+def rewrite_definition(definition: FitDefinition) -> FitDefinition:
     """
-    Clean up the FIT file by processing and removing unnecessary fields.
-    Also, calculate average values for cadence, power, and heart rate.
+    Return the definition a message type gets in the cleaned file.
+
+    Sessions get the average fields they are missing, then the compiled
+    field transforms are applied, so rules can still drop or change the
+    averages.
+
+    Args:
+        definition (FitDefinition): The definition from the input file.
+
+    Returns:
+        FitDefinition: The definition to write to the cleaned file.
+    """
+    definition = add_average_fields(definition)
+    return compile_transform_plan(definition, FIELD_TRANSFORMS).definition
+
+
+class FitCleaner:
+    """
+    Cleans up a FIT file one batch of segments at a time.
+
+    Every definition and column run is transformed and encoded as soon as
+    it is added, and the record sums behind the session averages are kept
+    as running totals, so finishing the file only needs the header and
+    the CRC.
+    """
+
+    def __init__(self):
+        self.sums = dict.fromkeys(AVERAGED_FIELDS, 0)
+        self.count = 0
+        self.body: List[bytes] = []
+        self.body_size = 0
+        self.body_crc = 0
+
+    def add(self, segments: list):
+        """
+        Clean up and encode definitions and column runs in file order.
+
+        Args:
+            segments (list): FitDefinition and FitColumns objects.
+        """
+        cleaned = []
+        for segment in segments:
+            if isinstance(segment, FitDefinition):
+                cleaned.append(rewrite_definition(segment))
+            else:
+                cleaned.append(self._clean_run(segment))
+        encoded = encode_column_segments(cleaned)
+        self.body.append(encoded)
+        self.body_size += len(encoded)
+        self.body_crc = fit_crc(encoded, self.body_crc)
+
+    def _clean_run(self, segment: FitColumns) -> FitColumns:
+        definition = add_average_fields(segment.definition)
+        values = segment.values
+        if definition != segment.definition:
+            values = project_columns(values, definition)
+        if definition.global_number == SESSION_MESSAGE:
+            values = np.array(values)
+            for row in range(len(values)):
+                current = FitColumns(definition, values[row:row + 1])
+                for name in AVERAGED_FIELDS:
+                    if not field_values(current, f"avg_{name}")[0]:
+                        values[f"avg_{name}"][row] = round(
+                            self.sums[name] / self.count if self.count else 0
+                        )
+                self.sums = dict.fromkeys(AVERAGED_FIELDS, 0)
+                self.count = 0
+        plan = compile_transform_plan(definition, FIELD_TRANSFORMS)
+        run = FitColumns(plan.definition, apply_transform_plan(plan, values))
+        if run.definition.global_number == RECORD_MESSAGE:
+            for name in AVERAGED_FIELDS:
+                self.sums[name] += int(field_values(run, name).sum())
+            self.count += len(run.values)
+        return run
+
+    def finish(self, template_header: bytes) -> bytes:
+        """
+        Return the cleaned file: header, encoded body and CRC.
+
+        Args:
+            template_header (bytes): The header of the input file.
+        """
+        header = build_fit_header(self.body_size, template_header)
+        crc = fit_crc_combine(fit_crc(header), self.body_crc, self.body_size)
+        return header + b"".join(self.body) + struct.pack("<H", crc)
+
+
+def cleanup_fit_columns(data: bytes) -> bytes:
+    """
+    Clean up the contents of a FIT file using column runs.
+
+    Same clean-up as cleanup_fit_records, but every run of messages is
+    handled with whole-array operations instead of one object per record.
+
+    Args:
+        data (bytes): The contents of the input FIT file.
+
+    Returns:
+        bytes: The contents of the cleaned FIT file.
+
+    Raises:
+        ValueError: If the file is not a valid FIT file.
+    """
+    fit = decode_fit_columns(data)
+    cleaner = FitCleaner()
+    cleaner.add(fit.segments)
+    return cleaner.finish(fit.header)
+
+
+def transform_message(message: DataMessage) -> None:
+    """
+    Apply the field transforms to a fit_tool message, for the fallback
+    clean-up path. Renames are only supported by the columnar path.
+
+    Args:
+        message (DataMessage): The message to modify in place.
+
+    Returns:
+        None
+    """
+    for rule in FIELD_TRANSFORMS:
+        if rule.message != message.global_id:
+            continue
+        if rule.action == "drop":
+            message.remove_field(rule.field)
+            continue
+        field = message.get_field(rule.field)
+        if field is None or rule.action == "rename":
+            continue
+        base_type = field.base_type
+        low, high = base_type.min, base_type.max
+        if low is not None and high is not None:
+            # Keep transformed values off the invalid value, like
+            # transform_column does.
+            invalid = base_type.invalid_raw_value()
+            if invalid == low:
+                low += 1
+            elif invalid == high:
+                high -= 1
+        for index, encoded_value in enumerate(field.encoded_values):
+            if (not isinstance(encoded_value, (int, float))
+                    or (low is not None
+                        and encoded_value == base_type.invalid_raw_value())):
+                continue
+            value = transform_value(encoded_value, rule)
+            if not base_type.is_float():
+                value = round(value)
+            if low is not None and high is not None:
+                value = min(max(value, low), high)
+            field.set_encoded_value(index, value)
+
+
+def cleanup_fit_records(fit_file_path: Path, new_file_path: Path) -> None:
+    """
+    Clean up the FIT file using fit_tool's message objects.
 
     Args:
         fit_file_path (Path): The path to the input FIT file.
@@ -342,10 +661,10 @@ def cleanup_fit_file(fit_file_path: Path, new_file_path: Path) -> None:
         None
     """
     builder = FitFileBuilder()
-    fit_file = FitFile.from_file(str(fit_file_path))
+    records = FitFile.from_file(str(fit_file_path)).records
     lap_values, cadence_values, power_values, heart_rate_values = reset_values()
 
-    for record in fit_file.records:
+    for record in records:
         message = record.message
         if isinstance(message, LapMessage):
             append_value(lap_values, message, "start_time")
@@ -358,8 +677,10 @@ def cleanup_fit_file(fit_file_path: Path, new_file_path: Path) -> None:
             append_value(lap_values, message, "avg_cadence")
             append_value(lap_values, message, "max_cadence")
             append_value(lap_values, message, "total_calories")
+        if isinstance(message, DataMessage) and not isinstance(
+                message, SessionMessage):
+            transform_message(message)
         if isinstance(message, RecordMessage):
-            message.remove_field(RecordTemperatureField.ID)
             append_value(cadence_values, message, "cadence")
             append_value(power_values, message, "power")
             append_value(heart_rate_values, message, "heart_rate")
@@ -370,9 +691,32 @@ def cleanup_fit_file(fit_file_path: Path, new_file_path: Path) -> None:
                 message.avg_power = calculate_avg(power_values)
             if not message.avg_heart_rate:
                 message.avg_heart_rate = calculate_avg(heart_rate_values)
+            # After the averages, so rules can still drop or change them.
+            transform_message(message)
             lap_values, cadence_values, power_values, heart_rate_values = reset_values()
         builder.add(message)
     builder.build().to_file(str(new_file_path))
+
+
+def cleanup_fit_file(fit_file_path: Path, new_file_path: Path) -> None:
+    """
+    Clean up the FIT file by processing and removing unnecessary fields.
+    Also, calculate average values for cadence, power, and heart rate.
+
+    Args:
+        fit_file_path (Path): The path to the input FIT file.
+        new_file_path (Path): The path to save the processed FIT file.
+
+    Returns:
+        None
+    """
+    try:
+        new_file_path.write_bytes(
+            cleanup_fit_columns(fit_file_path.read_bytes())
+        )
+    except ValueError as e:
+        logger.info(f"Columnar clean-up failed ({e}), using fit_tool.")
+        cleanup_fit_records(fit_file_path, new_file_path)
     logger.info(f"Cleaned-up file saved as {SCRIPT_DIR}/{new_file_path.name}")
 
 
@@ -395,37 +739,91 @@ def generate_new_filename(fit_file: Path) -> str:
     return f"{fit_file.stem}_{timestamp}.fit"
 
 
-def cleanup_and_save_fit_file(fitfile_location: Path) -> Path:
+def find_known_activity(fingerprint: ActivityFingerprint) -> Optional[tuple]:
+    """
+    Look up a ride in the fingerprint index shared with strava/main.py.
+
+    Args:
+        fingerprint (ActivityFingerprint): The fingerprint of the ride.
+
+    Returns:
+        tuple or None: The (source, file name) the ride was first handled
+        as, or None if it is new or the index can't be read.
+    """
+    try:
+        fingerprints = FingerprintIndex()
+        try:
+            return fingerprints.lookup(fingerprint)
+        finally:
+            fingerprints.close()
+    except sqlite3.Error as e:
+        logger.info(f"Could not read the fingerprint index ({e}), "
+                    "treating the ride as new.")
+        return None
+
+
+def remember_activity(fingerprint: ActivityFingerprint, file_name: str):
+    """Add a ride to the fingerprint index shared with strava/main.py."""
+    try:
+        fingerprints = FingerprintIndex()
+        try:
+            fingerprints.add(fingerprint, "mywhoosh", file_name)
+        finally:
+            fingerprints.close()
+    except sqlite3.Error as e:
+        logger.error(f"Could not add {file_name} to the fingerprint "
+                     f"index: {e}.")
+
+
+def cleanup_and_save_fit_file(fitfile_location: Path
+                              ) -> Tuple[Optional[Path],
+                                         Optional[ActivityFingerprint]]:
     """
     Clean up the most recent .fit file in a directory and save it 
     with a timestamped filename.
 
+    Rides that were already uploaded, from this folder or from a Strava
+    export, are skipped before any clean-up work.
+
     Args:
         fitfile_location (Path): The directory containing the .fit files.
 
     Returns:
-        Path: The path to the newly saved and cleaned .fit file, 
-        or an empty Path if no .fit file is found or if the path is invalid.
+        tuple: The path to the newly saved and cleaned .fit file, or None
+        if no .fit file is found, if the path is invalid or if the ride
+        was already uploaded, and the fingerprint of the original file
+        (None if it could not be fingerprinted).
     """
     if not fitfile_location.is_dir():
         logger.info(f"The specified path is not a directory:"
                     f"{fitfile_location}.")
-        return Path()
+        return None, None
 
     logger.debug(f"Checking for .fit files in directory: {fitfile_location}.")
     fit_file = get_most_recent_fit_file(fitfile_location)
 
-    if not fit_file:
+    if not fit_file.is_file():
         logger.info("No .fit files found.")
-        return Path()
+        return None, None
 
     logger.debug(f"Found the most recent .fit file: {fit_file.name}.")
+    try:
+        fingerprint = fingerprint_fit_file(fit_file)
+    except OSError as e:
+        logger.info(f"Could not fingerprint {fit_file.name}: {e}.")
+        fingerprint = None
+    known = find_known_activity(fingerprint) if fingerprint else None
+    if known:
+        logger.info(f"{fit_file.name} was already uploaded as {known[1]} "
+                    f"({known[0]}), skipping.")
+        return None, None
+
     new_filename = generate_new_filename(fit_file)
 
     if not BACKUP_FITFILE_LOCATION.exists():
         logger.error(f"{BACKUP_FITFILE_LOCATION} does not exist."
                      "Did you delete it?")
-        return Path()
+        return None, None
 
     new_file_path = BACKUP_FITFILE_LOCATION / new_filename
     logger.info(f"Cleaning up {new_file_path}.")
@@ -434,13 +832,41 @@ def cleanup_and_save_fit_file(fitfile_location: Path) -> Path:
         cleanup_fit_file(fit_file, new_file_path)  
         logger.info(f"Successfully cleaned {fit_file.name} "
                     f"and saved it as {new_file_path.name}.")
-        return new_file_path
+        return new_file_path, fingerprint
     except Exception as e:
         logger.error(f"Failed to process {fit_file.name}: {e}.")
-        return Path()
+        return None, None
+
+
+def get_http_status(error: GarthHTTPError) -> int:
+    """Return the HTTP status code wrapped by a GarthHTTPError, or 0."""
+    response = getattr(error.error, "response", None)
+    return response.status_code if response is not None else 0
+
+
+def is_rejected_upload(error: GarthHTTPError) -> bool:
+    """Return True if Garmin Connect rejected the file and a retry won't help."""
+    status = get_http_status(error)
+    return 400 <= status < 500 and status not in RETRYABLE_CLIENT_ERRORS
+
+
+def get_retry_after(error: GarthHTTPError) -> Optional[float]:
+    """Return the Retry-After delay of a throttled request in seconds, if any."""
+    response = getattr(error.error, "response", None)
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
 
 
-def upload_fit_file_to_garmin(new_file_path: Path):
+def upload_fit_file_to_garmin(new_file_path: Path) -> Optional[str]:
     """
     Upload a .fit file to Garmin using the Garth client.
 
@@ -448,32 +874,645 @@ def upload_fit_file_to_garmin(new_file_path: Path):
         new_file_path (Path): The path to the .fit file to upload.
 
     Returns:
-        None
+        str or None: UPLOAD_CREATED if the activity was uploaded now,
+        UPLOAD_DUPLICATE if Garmin Connect already had it, None if the
+        file does not exist.
+
+    Raises:
+        GarthHTTPError, RequestException: If the upload failed and
+        should be retried later.
     """
+    if not (new_file_path and new_file_path.is_file()):
+        logger.info(f"Invalid file path: {new_file_path}.")
+        return None
     try:
-        if new_file_path and new_file_path.exists():
-            with open(new_file_path, "rb") as f:
-                uploaded = garth.client.upload(f)
-                logger.debug(uploaded)
-        else:
-            logger.info(f"Invalid file path: {new_file_path}.")
-    except GarthHTTPError:
-        logger.info("Duplicate activity found on Garmin Connect.")
+        with open(new_file_path, "rb") as f:
+            uploaded = garth.client.upload(f)
+            logger.debug(uploaded)
+    except GarthHTTPError as e:
+        if get_http_status(e) != HTTP_CONFLICT:
+            raise
+        return UPLOAD_DUPLICATE
+    return UPLOAD_CREATED
+
+
+class UploadOutbox:
+    """
+    SQLite-backed queue of cleaned .fit files waiting to be uploaded.
+
+    Files are queued as soon as they are cleaned and stay queued until
+    Garmin Connect has them, so uploads survive network failures and
+    restarts. Files Garmin Connect rejects are parked as 'dead' and left
+    for the user to look at; any other failure is retried.
+
+    Several processes (e.g. --serve and a plain run) may share the
+    outbox, so a claimed upload is leased to the claiming process and
+    only taken over once the lease is stale.
+    """
+
+    def __init__(self, db_file: Path = OUTBOX_PATH):
+        self.conn = sqlite3.connect(str(db_file), check_same_thread=False)
+        self.lock = threading.Lock()
+        self.owner = str(os.getpid())
+        self._create_table()
+
+    def _create_table(self):
+        """Create the outbox table if it doesn't exist."""
+        query = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            file_path TEXT PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            queued_at REAL NOT NULL,
+            finished_at REAL,
+            fingerprint TEXT,
+            claimed_at REAL,
+            claimed_by TEXT
+        )
+        """
+        added_columns = {
+            "fingerprint": "TEXT",
+            "claimed_at": "REAL",
+            "claimed_by": "TEXT",
+        }
+        with self.lock:
+            self.conn.execute(query)
+            columns = {row[1] for row in
+                       self.conn.execute("PRAGMA table_info(outbox)")}
+            for name, column_type in added_columns.items():
+                if name not in columns:
+                    self.conn.execute(
+                        f"ALTER TABLE outbox ADD COLUMN {name} {column_type}"
+                    )
+            self.conn.commit()
+
+    def enqueue(self, file_path: Path,
+                fingerprint: Optional[ActivityFingerprint] = None):
+        """
+        Queue a cleaned .fit file for upload.
+
+        The fingerprint of the original ride is added to the fingerprint
+        index once the upload is done.
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO outbox "
+                "(file_path, next_attempt_at, queued_at, fingerprint) "
+                "VALUES (?, ?, ?, ?)",
+                (str(file_path), now, now,
+                 fingerprint.key if fingerprint else None)
+            )
+            self.conn.commit()
+        logger.info(f"Queued {file_path.name} for upload.")
+
+    def claim(self) -> Optional[Path]:
+        """
+        Take the oldest upload that is due, or whose lease went stale,
+        and lease it to this process.
+        """
+        claimable = (
+            "((status = 'pending' AND next_attempt_at <= ?) "
+            "OR (status = 'in_flight' AND claimed_at < ?))"
+        )
+        with self.lock:
+            while True:
+                now = time.time()
+                due = (now, now - OUTBOX_LEASE_SECONDS)
+                row = self.conn.execute(
+                    f"SELECT file_path FROM outbox WHERE {claimable} "
+                    "ORDER BY queued_at LIMIT 1",
+                    due
+                ).fetchone()
+                if not row:
+                    return None
+                # Another process may have claimed the row since the
+                # SELECT; the update then matches nothing.
+                claimed = self.conn.execute(
+                    "UPDATE outbox SET status = 'in_flight', claimed_at = ?, "
+                    f"claimed_by = ? WHERE file_path = ? AND {claimable}",
+                    (now, self.owner, row[0]) + due
+                ).rowcount
+                self.conn.commit()
+                if claimed:
+                    return Path(row[0])
+
+    def mark_done(self, file_path: Path):
+        """Mark an upload as finished."""
+        with self.lock:
+            self.conn.execute(
+                "UPDATE outbox SET status = 'done', finished_at = ? "
+                "WHERE file_path = ?",
+                (time.time(), str(file_path))
+            )
+            self.conn.commit()
+
+    def fingerprint(self, file_path: Path) -> Optional[ActivityFingerprint]:
+        """Return the fingerprint an upload was queued with, if any."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT fingerprint FROM outbox WHERE file_path = ?",
+                (str(file_path),)
+            ).fetchone()
+        if not (row and row[0]):
+            return None
+        return ActivityFingerprint.from_key(row[0])
+
+    def mark_failed(self, file_path: Path, error: str,
+                    retry_after: Optional[float] = None):
+        """
+        Schedule a failed upload for a retry with exponential backoff.
+
+        Transient failures are retried for as long as it takes, so rides
+        recorded offline are uploaded once Garmin Connect is reachable.
+        A Retry-After delay from the server is never shortened.
+        """
+        with self.lock:
+            (attempts,) = self.conn.execute(
+                "SELECT attempts FROM outbox WHERE file_path = ?",
+                (str(file_path),)
+            ).fetchone()
+            delay = min(OUTBOX_BACKOFF_BASE * 2 ** attempts,
+                        OUTBOX_BACKOFF_MAX)
+            delay *= random.uniform(0.8, 1.2)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            self.conn.execute(
+                "UPDATE outbox SET status = 'pending', attempts = ?, "
+                "next_attempt_at = ?, last_error = ? WHERE file_path = ?",
+                (attempts + 1, time.time() + delay, error, str(file_path))
+            )
+            self.conn.commit()
+        logger.info(f"Upload of {file_path.name} failed ({error}), "
+                    f"retrying in {delay:.0f}s.")
+
+    def mark_dead(self, file_path: Path, error: str):
+        """Park an upload that should not be retried."""
+        with self.lock:
+            self.conn.execute(
+                "UPDATE outbox SET status = 'dead', attempts = attempts + 1, "
+                "last_error = ?, finished_at = ? WHERE file_path = ?",
+                (error, time.time(), str(file_path))
+            )
+            self.conn.commit()
+        logger.error(f"Giving up on uploading {file_path.name} ({error}), "
+                     "the file is kept in the backup folder.")
+
+    def pending_count(self) -> int:
+        """Return the number of uploads that are not finished yet."""
+        with self.lock:
+            (count,) = self.conn.execute(
+                "SELECT COUNT(*) FROM outbox "
+                "WHERE status IN ('pending', 'in_flight')"
+            ).fetchone()
+        return count
+
+    def seconds_until_next(self) -> Optional[float]:
+        """Return the time until the next pending upload is due, if any."""
+        with self.lock:
+            (next_attempt_at,) = self.conn.execute(
+                "SELECT MIN(next_attempt_at) FROM outbox "
+                "WHERE status = 'pending'"
+            ).fetchone()
+        if next_attempt_at is None:
+            return None
+        return max(next_attempt_at - time.time(), 0)
+
+    def close(self):
+        """Give back the uploads this process still holds and close."""
+        with self.lock:
+            self.conn.execute(
+                "UPDATE outbox SET status = 'pending' "
+                "WHERE status = 'in_flight' AND claimed_by = ?",
+                (self.owner,)
+            )
+            self.conn.commit()
+        self.conn.close()
+
+
+class OutboxDrainer(threading.Thread):
+    """Background thread that uploads queued files until none are left."""
+
+    def __init__(self, outbox: UploadOutbox, stop_when_idle: bool = True,
+                 poll_interval: float = 5.0):
+        super().__init__(name="outbox-drainer", daemon=True)
+        self.outbox = outbox
+        self.stop_when_idle = stop_when_idle
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+
+    def stop(self):
+        """Ask the drainer to stop after the current upload."""
+        self.stop_event.set()
+        self.wake_event.set()
+
+    def wake(self):
+        """Check the outbox now instead of after the poll interval."""
+        self.wake_event.set()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            file_path = self.outbox.claim()
+            if file_path is None:
+                wait = self.outbox.seconds_until_next()
+                if wait is None and self.stop_when_idle:
+                    break
+                self.wake_event.wait(min(wait or self.poll_interval,
+                                         self.poll_interval))
+                self.wake_event.clear()
+                continue
+            try:
+                result = upload_fit_file_to_garmin(file_path)
+                if result == UPLOAD_CREATED:
+                    logger.info(f"Uploaded {file_path.name}.")
+                elif result == UPLOAD_DUPLICATE:
+                    logger.info(f"{file_path.name} is already on Garmin "
+                                "Connect (duplicate activity).")
+                self.outbox.mark_done(file_path)
+                # Only rides that reached Garmin Connect count as handled.
+                fingerprint = self.outbox.fingerprint(file_path)
+                if result and fingerprint:
+                    remember_activity(fingerprint, file_path.name)
+            except GarthHTTPError as e:
+                if is_rejected_upload(e):
+                    self.outbox.mark_dead(file_path, str(e))
+                else:
+                    self.outbox.mark_failed(file_path, str(e),
+                                            get_retry_after(e))
+            except (GarthException, RequestException) as e:
+                self.outbox.mark_failed(file_path, str(e))
+            except Exception as e:
+                logger.error(f"Unexpected error uploading {file_path.name}: "
+                             f"{e!r}.")
+                self.outbox.mark_failed(file_path, repr(e))
 
 
 def main():
     """
-    Main function to authenticate to Garmin, clean and save the FIT file, 
-    and upload it to Garmin.
+    Main function to clean and save the FIT file, queue it for upload,
+    authenticate to Garmin and upload everything in the outbox.
 
     Returns:
         None
     """
-    authenticate_to_garmin()
-    new_file_path = cleanup_and_save_fit_file(FITFILE_LOCATION)
+    outbox = UploadOutbox()
+    new_file_path, fingerprint = cleanup_and_save_fit_file(FITFILE_LOCATION)
     if new_file_path:
-        upload_fit_file_to_garmin(new_file_path)
+        outbox.enqueue(new_file_path, fingerprint)
+    if not outbox.pending_count():
+        outbox.close()
+        return
+    try:
+        authenticate_to_garmin()
+    except RequestException as e:
+        logger.info(f"Garmin Connect is unreachable: {e}. "
+                    "Queued uploads will be retried on the next run.")
+        outbox.close()
+        return
+    drainer = OutboxDrainer(outbox)
+    drainer.start()
+    drainer.join(OUTBOX_DRAIN_TIMEOUT)
+    if drainer.is_alive():
+        drainer.stop()
+        drainer.join()
+    pending = outbox.pending_count()
+    if pending:
+        logger.info(f"{pending} upload(s) still queued, "
+                    "they will be retried on the next run.")
+    outbox.close()
+
+
+def handle_daemon_job(job: dict, outbox: UploadOutbox,
+                      drainer: OutboxDrainer) -> dict:
+    """
+    Run one job received by the daemon.
+
+    Args:
+        job (dict): The job, e.g. {"command": "process"}.
+        outbox (UploadOutbox): The daemon's upload outbox.
+        drainer (OutboxDrainer): The daemon's upload drainer.
+
+    Returns:
+        dict: The reply sent back to the client.
+    """
+    command = job.get("command") if isinstance(job, dict) else None
+    if command == "process":
+        new_file_path, fingerprint = cleanup_and_save_fit_file(
+            FITFILE_LOCATION
+        )
+        if not new_file_path:
+            return {"status": "no_file"}
+        outbox.enqueue(new_file_path, fingerprint)
+        drainer.wake()
+        return {"status": "queued", "file": str(new_file_path)}
+    if command == "status":
+        return {"status": "ok", "pending_uploads": outbox.pending_count()}
+    return {"status": "error", "message": f"Unknown command: {command}"}
+
+
+def claim_daemon_address() -> bytes:
+    """
+    Take over the daemon socket for this process and write a fresh key.
+
+    Returns:
+        bytes: The key clients must authenticate with.
+
+    Exits:
+        Exits with status 1 if a daemon or live instance is already
+        running.
+    """
+    if send_daemon_job({"command": "status"}) is not None:
+        logger.error(f"A daemon is already running at {DAEMON_ADDRESS}.")
+        sys.exit(1)
+    authkey = os.urandom(32)
+    # Created owner-only from the start; a key left by an older run may
+    # have looser permissions, so it is replaced rather than truncated.
+    DAEMON_KEY_PATH.unlink(missing_ok=True)
+    fd = os.open(DAEMON_KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(authkey)
+    if os.name != "nt" and os.path.exists(DAEMON_ADDRESS):
+        os.unlink(DAEMON_ADDRESS)
+    return authkey
+
+
+def run_job_server(authkey: bytes, handle_job: Callable[[dict], dict]):
+    """
+    Answer jobs sent with --trigger until interrupted.
+
+    A job that fails is logged and answered with an error, so one bad
+    job never stops the server.
+
+    Args:
+        authkey (bytes): The key from claim_daemon_address().
+        handle_job (callable): Returns the reply to a job.
+    """
+    with Listener(DAEMON_ADDRESS, authkey=authkey) as listener:
+        logger.info(f"Daemon listening on {DAEMON_ADDRESS}.")
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, AuthenticationError) as e:
+                logger.info(f"Rejected daemon connection: {e}.")
+                continue
+            with conn:
+                try:
+                    job = conn.recv()
+                except (EOFError, OSError):
+                    continue
+                try:
+                    reply = handle_job(job)
+                except Exception as e:
+                    logger.error(f"Daemon job {job} failed: {e}.")
+                    reply = {"status": "error", "message": str(e)}
+                try:
+                    conn.send(reply)
+                except OSError as e:
+                    logger.info(f"Could not send the reply: {e}.")
+
+
+def serve():
+    """
+    Run as a resident service that keeps the interpreter, the imported
+    modules and the authenticated Garth client warm, and processes jobs
+    sent with --trigger over a local socket (named pipe on Windows).
+
+    Returns:
+        None
+
+    Exits:
+        Exits with status 1 if another daemon is already running.
+    """
+    authkey = claim_daemon_address()
+    try:
+        authenticate_to_garmin()
+    except RequestException as e:
+        logger.info(f"Garmin Connect is unreachable: {e}. "
+                    "Uploads will be retried in the background.")
+    outbox = UploadOutbox()
+    drainer = OutboxDrainer(outbox, stop_when_idle=False)
+    drainer.start()
+    try:
+        run_job_server(
+            authkey, lambda job: handle_daemon_job(job, outbox, drainer)
+        )
+    except KeyboardInterrupt:
+        logger.info("Daemon stopped.")
+    finally:
+        drainer.stop()
+        drainer.join()
+        outbox.close()
+        DAEMON_KEY_PATH.unlink(missing_ok=True)
+
+
+class LiveRideTail:
+    """
+    Follows a .fit file while MyWhoosh is still writing it and cleans up
+    each batch of appended messages as it arrives.
+    """
+
+    def __init__(self, fit_file: Path):
+        self.fit_file = fit_file
+        self.decoder = FitStreamDecoder()
+        self.cleaner = FitCleaner()
+        self.read_offset = 0
+
+    def poll(self) -> Optional[bytes]:
+        """
+        Decode and clean up whatever was appended since the last poll.
+
+        Returns:
+            bytes or None: The cleaned file once the ride is complete,
+            i.e. the header gives the final data size and the CRC has
+            been written, otherwise None.
+
+        Raises:
+            ValueError: If the file was truncated or rewritten, or is not
+            a valid FIT file.
+        """
+        with open(self.fit_file, "rb") as f:
+            header = f.read(12)
+            size = os.fstat(f.fileno()).st_size
+            if size < self.read_offset:
+                raise ValueError("the file was truncated")
+            f.seek(self.read_offset)
+            appended = f.read(size - self.read_offset)
+        self.read_offset += len(appended)
+        data_end = None
+        if len(header) == 12:
+            header_size, data_size = parse_fit_header(header)
+            if data_size and self.read_offset >= header_size + data_size + 2:
+                data_end = header_size + data_size
+        self.cleaner.add(self.decoder.feed(appended, data_end))
+        if data_end is None or not self.decoder.finished(data_end):
+            return None
+        return self.cleaner.finish(self.decoder.header)
+
+
+def save_live_ride(fit_file: Path, cleaned: bytes
+                   ) -> Tuple[Optional[Path], Optional[ActivityFingerprint]]:
+    """
+    Save a ride cleaned by LiveRideTail with a timestamped filename.
+
+    Args:
+        fit_file (Path): The .fit file written by MyWhoosh.
+        cleaned (bytes): The contents of the cleaned file.
+
+    Returns:
+        tuple: The path to the saved file, or None if the ride was
+        already uploaded or the backup folder is missing, and the
+        fingerprint of the ride.
+    """
+    # The original file, like the other paths: field transforms may
+    # change the power and heart rate the fingerprint is based on.
+    try:
+        fingerprint = fingerprint_fit_file(fit_file)
+    except OSError as e:
+        logger.info(f"Could not fingerprint {fit_file.name}: {e}.")
+        fingerprint = None
+    known = find_known_activity(fingerprint) if fingerprint else None
+    if known:
+        logger.info(f"{fit_file.name} was already uploaded as {known[1]} "
+                    f"({known[0]}), skipping.")
+        return None, None
+    if not BACKUP_FITFILE_LOCATION.exists():
+        logger.error(f"{BACKUP_FITFILE_LOCATION} does not exist."
+                     "Did you delete it?")
+        return None, None
+    new_file_path = BACKUP_FITFILE_LOCATION / generate_new_filename(fit_file)
+    new_file_path.write_bytes(cleaned)
+    logger.info(f"Successfully cleaned {fit_file.name} "
+                f"and saved it as {new_file_path.name}.")
+    return new_file_path, fingerprint
+
+
+def handle_live_job(job: dict, outbox: UploadOutbox) -> dict:
+    """
+    Answer a job sent to a live instance.
+
+    Live mode picks up every ride by itself, so "process" only reports
+    that instead of cleaning the ride a second time.
+
+    Args:
+        job (dict): The job, e.g. {"command": "process"}.
+        outbox (UploadOutbox): The live instance's upload outbox.
+
+    Returns:
+        dict: The reply sent back to the client.
+    """
+    command = job.get("command") if isinstance(job, dict) else None
+    if command == "process":
+        return {"status": "live"}
+    if command == "status":
+        return {"status": "ok", "mode": "live",
+                "pending_uploads": outbox.pending_count()}
+    return {"status": "error", "message": f"Unknown command: {command}"}
+
+
+def live():
+    """
+    Clean up rides while they are being recorded and upload them as soon
+    as they end.
+
+    The most recent .fit file is tailed during the ride, so the cleaned
+    file is already encoded when MyWhoosh writes the session message and
+    the CRC; only the header and CRC of the cleaned file are left to do.
+    Live mode also listens on the daemon socket, so --trigger does not
+    process the ride a second time while it runs.
+
+    Returns:
+        None
+
+    Exits:
+        Exits with status 1 if a daemon is already running.
+    """
+    authkey = claim_daemon_address()
+    try:
+        authenticate_to_garmin()
+    except RequestException as e:
+        logger.info(f"Garmin Connect is unreachable: {e}. "
+                    "Uploads will be retried in the background.")
+    outbox = UploadOutbox()
+    drainer = OutboxDrainer(outbox, stop_when_idle=False)
+    drainer.start()
+    threading.Thread(
+        target=run_job_server,
+        args=(authkey, lambda job: handle_live_job(job, outbox)),
+        name="job-server",
+        daemon=True,
+    ).start()
+    tail = None
+    # (file, modification time) of the last ride that was finished or
+    # could not be decoded; it is picked up again once the file changes.
+    finished = None
+    logger.info(f"Watching {FITFILE_LOCATION} for rides.")
+    try:
+        while True:
+            fit_file = get_most_recent_fit_file(FITFILE_LOCATION)
+            try:
+                state = (fit_file, fit_file.stat().st_mtime_ns)
+            except OSError:
+                # Replaced or deleted since the glob; look again next time.
+                state = None
+            if state and fit_file.is_file():
+                if state != finished:
+                    if tail is None or tail.fit_file != fit_file:
+                        tail = LiveRideTail(fit_file)
+                    try:
+                        cleaned = tail.poll()
+                    except (OSError, ValueError) as e:
+                        logger.info(f"Stopped following {fit_file.name} "
+                                    f"({e}), restarting when it changes.")
+                        finished = state
+                        tail = None
+                        cleaned = None
+                    if cleaned is not None:
+                        try:
+                            finished = (fit_file, fit_file.stat().st_mtime_ns)
+                        except OSError:
+                            finished = state
+                        tail = None
+                        new_file_path, fingerprint = save_live_ride(
+                            fit_file, cleaned
+                        )
+                        if new_file_path:
+                            outbox.enqueue(new_file_path, fingerprint)
+                            drainer.wake()
+            time.sleep(LIVE_POLL_INTERVAL)
+    except KeyboardInterrupt:
+        logger.info("Live mode stopped.")
+    finally:
+        drainer.stop()
+        drainer.join()
+        outbox.close()
+        DAEMON_KEY_PATH.unlink(missing_ok=True)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(
+        description="Fix MyWhoosh .fit files and upload them to "
+                    "Garmin Connect."
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--serve", action="store_true",
+                      help="Stay resident and process jobs sent with "
+                           "--trigger.")
+    mode.add_argument("--trigger", action="store_true",
+                      help="Ask the running daemon to process the most "
+                           "recent .fit file; runs in-process if no "
+                           "daemon is running.")
+    mode.add_argument("--live", action="store_true",
+                      help="Clean up rides while they are being recorded "
+                           "and upload them as soon as they end.")
+    args = parser.parse_args()
+    load_settings()
+    if args.serve:
+        serve()
+    elif args.live:
+        live()
+    else:
+        main()
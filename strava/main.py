@@ -7,7 +7,11 @@ Handles authentication, session management, and tracks downloaded activities in
 import json
 import os
 import sqlite3
+import sys
+import tempfile
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import List, Optional
@@ -15,7 +19,12 @@ from urllib.parse import parse_qs, urlparse
 
 from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from requests import Session
+from requests import Response, Session
+from requests.auth import AuthBase
+
+# The fingerprint index is shared with myWhoosh2Garmin.py in the parent folder.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from activity_fingerprint import FingerprintIndex, fingerprint_fit_file  # noqa: E402
 
 
 class StravaSettings(BaseSettings):
@@ -29,6 +38,8 @@ class StravaSettings(BaseSettings):
     cookie_file: str = "cookie.json"
     activities_url: str = "https://www.strava.com/api/v3/athlete/activities"
     database_file: str = "strava.db"
+    token_refresh_margin: int = 300
+    download_workers: int = 4
 
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
@@ -61,7 +72,8 @@ class ActivityDatabase:
     """Database handler for tracking downloaded activities."""
     
     def __init__(self, db_file: str):
-        self.conn = sqlite3.connect(db_file)
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.lock = threading.Lock()
         self._create_table()
 
     def _create_table(self):
@@ -72,61 +84,148 @@ class ActivityDatabase:
             downloaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
         """
-        self.conn.execute(query)
-        self.conn.commit()
+        with self.lock:
+            self.conn.execute(query)
+            self.conn.commit()
 
     def is_downloaded(self, activity_id: int) -> bool:
         """Check if activity is already downloaded."""
-        cursor = self.conn.execute(
-            "SELECT 1 FROM downloaded_activities WHERE activity_id = ?",
-            (activity_id,)
-        )
-        return bool(cursor.fetchone())
+        with self.lock:
+            cursor = self.conn.execute(
+                "SELECT 1 FROM downloaded_activities WHERE activity_id = ?",
+                (activity_id,)
+            )
+            return bool(cursor.fetchone())
 
     def mark_downloaded(self, activity_id: int):
         """Mark an activity as downloaded."""
-        self.conn.execute(
-            "INSERT OR IGNORE INTO downloaded_activities (activity_id) VALUES (?)",
-            (activity_id,)
-        )
-        self.conn.commit()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO downloaded_activities (activity_id) VALUES (?)",
+                (activity_id,)
+            )
+            self.conn.commit()
 
     def close(self):
         """Close database connection."""
         self.conn.close()
 
 
-class StravaAuth:
-    """Handles Strava OAuth2 authentication and token management."""
-    
+class TokenManager:
+    """
+    Shares Strava tokens between concurrent workers.
+
+    Tokens are refreshed before they expire, only one caller refreshes at
+    a time while the others wait for its result, and the token file is
+    replaced atomically.
+    """
+
     def __init__(self, settings: StravaSettings):
         self.settings = settings
         self.token_data: Optional[TokenData] = None
-        self.session = Session()
-        self._initialize_session()
-
-    def _initialize_session(self):
-        """Initialize requests session with valid token."""
-        if self._load_tokens() and self._is_token_valid():
-            self.session.headers.update({
-                "Authorization": f"Bearer {self.token_data.access_token}"
-            })
-
-    def _is_token_valid(self) -> bool:
-        """Check if access token is still valid."""
-        if not self.token_data:
+        self._lock = threading.RLock()
+        self._load_tokens()
+
+    def _load_tokens(self) -> bool:
+        """Load tokens from storage file."""
+        if os.path.exists(self.settings.token_file):
+            with open(self.settings.token_file, "r") as f:
+                raw_data = json.load(f)
+            self.token_data = TokenData.from_json(raw_data)
+            return True
+        return False
+
+    def save_tokens(self, token_data: dict) -> None:
+        """Atomically write tokens to file and make them current."""
+        token_path = Path(self.settings.token_file).resolve()
+        with self._lock:
+            fd, tmp_path = tempfile.mkstemp(dir=token_path.parent,
+                                            prefix=f".{token_path.name}.")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(token_data, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, token_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            self.token_data = TokenData.from_json(token_data)
+
+    def is_fresh(self, token_data: Optional[TokenData] = None) -> bool:
+        """Check if an access token is valid for longer than the margin."""
+        token_data = token_data or self.token_data
+        if not token_data:
             return False
+        margin = timedelta(seconds=self.settings.token_refresh_margin)
+        return datetime.now() < token_data.expires_at - margin
+
+    def access_token(self) -> str:
+        """Return a fresh access token, refreshing it if it expires soon."""
+        token_data = self.token_data
+        if self.is_fresh(token_data):
+            return token_data.access_token
+        return self.refresh(token_data.access_token if token_data else None)
 
-        if isinstance(self.token_data.expires_at, int):
-            self.token_data.expires_at = datetime.fromtimestamp(
-                self.token_data.expires_at
+    def refresh(self, stale_access_token: Optional[str] = None) -> str:
+        """
+        Refresh the access token, unless another caller already replaced
+        stale_access_token with a fresh one while this one was waiting.
+        """
+        with self._lock:
+            current = self.token_data
+            if (current and current.access_token != stale_access_token
+                    and self.is_fresh(current)):
+                return current.access_token
+            if not current or not current.refresh_token:
+                raise ValueError("No refresh token available")
+
+            response = requests.post(
+                self.settings.token_url,
+                data={
+                    "client_id": self.settings.client_id,
+                    "client_secret": self.settings.client_secret,
+                    "grant_type": "refresh_token",
+                    "refresh_token": current.refresh_token,
+                },
             )
+            response.raise_for_status()
+            self.save_tokens(response.json())
+            return self.token_data.access_token
+
+    def refresh_after_unauthorized(self, response: Response) -> str:
+        """Refresh the token that a 401 response was sent for."""
+        header = response.request.headers.get("Authorization", "")
+        return self.refresh(header.removeprefix("Bearer ") or None)
+
+
+class BearerAuth(AuthBase):
+    """Adds the current access token to every request of a session."""
 
-        return datetime.now() < self.token_data.expires_at - timedelta(minutes=5)
+    def __init__(self, tokens: TokenManager):
+        self.tokens = tokens
+
+    def __call__(self, request):
+        request.headers["Authorization"] = f"Bearer {self.tokens.access_token()}"
+        return request
+
+
+class StravaAuth:
+    """Handles Strava OAuth2 authentication and token management."""
+    
+    def __init__(self, settings: StravaSettings):
+        self.settings = settings
+        self.tokens = TokenManager(settings)
+        self.session = Session()
+        self.session.auth = BearerAuth(self.tokens)
+
+    @property
+    def token_data(self) -> Optional[TokenData]:
+        return self.tokens.token_data
 
     def authenticate(self) -> None:
         """Main authentication flow with automatic token refresh."""
-        if not self._is_token_valid():
+        if not self.tokens.is_fresh():
             if self.token_data and self.token_data.refresh_token:
                 try:
                     self.refresh_token()
@@ -168,40 +267,13 @@ class StravaAuth:
             },
         )
         response.raise_for_status()
-        self._save_tokens(response.json())
-
-    def _save_tokens(self, token_data: dict) -> None:
-        """Save tokens to file and update session."""
-        with open(self.settings.token_file, "w") as f:
-            json.dump(token_data, f)
-        self.token_data = TokenData.from_json(token_data)
-        self._initialize_session()
-
-    def _load_tokens(self) -> bool:
-        """Load tokens from storage file."""
-        if os.path.exists(self.settings.token_file):
-            with open(self.settings.token_file, "r") as f:
-                raw_data = json.load(f)
-            self.token_data = TokenData.from_json(raw_data)
-            return True
-        return False
+        self.tokens.save_tokens(response.json())
 
     def refresh_token(self) -> None:
         """Refresh access token using refresh token."""
-        if not self.token_data or not self.token_data.refresh_token:
-            raise ValueError("No refresh token available")
-
-        response = requests.post(
-            self.settings.token_url,
-            data={
-                "client_id": self.settings.client_id,
-                "client_secret": self.settings.client_secret,
-                "grant_type": "refresh_token",
-                "refresh_token": self.token_data.refresh_token,
-            },
+        self.tokens.refresh(
+            self.token_data.access_token if self.token_data else None
         )
-        response.raise_for_status()
-        self._save_tokens(response.json())
 
 
 class CookieManager:
@@ -239,9 +311,12 @@ class ActivityDownloader:
         "Upgrade-Insecure-Requests": "1"
     }
 
-    def __init__(self, session: Session, database: ActivityDatabase):
+    def __init__(self, session: Session, database: ActivityDatabase,
+                 fingerprints: FingerprintIndex, tokens: TokenManager):
         self.session = session
         self.db = database
+        self.fingerprints = fingerprints
+        self.tokens = tokens
 
     def download_activity(self, activity_id: int) -> bool:
         """Download activity file with retry logic."""
@@ -250,7 +325,7 @@ class ActivityDownloader:
         except requests.HTTPError as e:
             if e.response.status_code == 401:
                 print("Token expired during download, refreshing...")
-                self.session.auth.refresh_token()
+                self.tokens.refresh_after_unauthorized(e.response)
                 return self._download_attempt(activity_id)
             raise
 
@@ -272,9 +347,26 @@ class ActivityDownloader:
                 f.write(chunk)
 
         self.db.mark_downloaded(activity_id)
+        if self._is_known_ride(filename):
+            os.remove(filename)
+            return False
         print(f"✅ Downloaded {filename}")
         return True
 
+    def _is_known_ride(self, filename: str) -> bool:
+        """Check whether the ride is already on Garmin Connect."""
+        try:
+            fingerprint = fingerprint_fit_file(filename)
+            known = self.fingerprints.lookup(fingerprint) if fingerprint else None
+        except (OSError, sqlite3.Error) as e:
+            print(f"⚠️ Could not check {filename} against uploaded rides: {e}")
+            return False
+        if known:
+            print(f"⏭️ {filename} is the same ride as {known[1]} "
+                  f"({known[0]}), skipped")
+            return True
+        return False
+
 
 class StravaClient:
     """Main client for interacting with Strava API."""
@@ -297,7 +389,7 @@ class StravaClient:
         except requests.HTTPError as e:
             if e.response.status_code == 401:
                 print("Token expired during request, refreshing...")
-                self.auth.refresh_token()
+                self.auth.tokens.refresh_after_unauthorized(e.response)
                 return self.get_filtered_activities()
             raise
 
@@ -317,6 +409,7 @@ class StravaClientBuilder:
         self.auth = StravaAuth(self.settings)
         self.cookie_manager = CookieManager(self.settings.cookie_file)
         self.database = ActivityDatabase(self.settings.database_file)
+        self.fingerprints = FingerprintIndex()
 
     def with_auth(self) -> "StravaClientBuilder":
         """Authenticate with Strava API."""
@@ -332,13 +425,16 @@ class StravaClientBuilder:
         """Build configured StravaClient instance."""
         downloader = ActivityDownloader(
             self.auth.session,
-            self.database
+            self.database,
+            self.fingerprints,
+            self.auth.tokens
         )
         return StravaClient(self.auth, downloader)
 
     def __del__(self):
         """Cleanup resources on deletion."""
         self.database.close()
+        self.fingerprints.close()
 
 
 if __name__ == "__main__":
@@ -362,10 +458,13 @@ if __name__ == "__main__":
             date_str = activity.start_date.strftime("%Y-%m-%d %H:%M")
             print(f"📅 {date_str} - {activity.name} (ID: {activity.id})")
 
-        new_downloads = 0
-        for activity in new_activities:
-            if client.downloader.download_activity(activity.id):
-                new_downloads += 1
+        with ThreadPoolExecutor(
+            max_workers=client_builder.settings.download_workers
+        ) as pool:
+            new_downloads = sum(pool.map(
+                client.downloader.download_activity,
+                [activity.id for activity in new_activities]
+            ))
 
         print("\nDownload summary:")
         print(f"• New activities downloaded: {new_downloads}")
@@ -377,3 +476,4 @@ if __name__ == "__main__":
     finally:
         if client_builder:
             client_builder.database.close()
+            client_builder.fingerprints.close()
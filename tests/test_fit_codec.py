@@ -0,0 +1,200 @@
+"""
+Round-trip checks for the columnar FIT decoder, encoder and clean-up.
+
+Usage: "python3 -m pytest tests"
+"""
+import random
+import struct
+import sys
+from pathlib import Path
+
+import pytest
+from fit_tool.fit_file import FitFile
+from fit_tool.fit_file_builder import FitFileBuilder
+from fit_tool.profile.messages.file_id_message import FileIdMessage
+from fit_tool.profile.messages.record_message import RecordMessage
+from fit_tool.profile.messages.session_message import SessionMessage
+from fit_tool.profile.profile_type import FileType, Manufacturer, Sport
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import myWhoosh2Garmin  # noqa: E402
+from fit_codec import (  # noqa: E402
+    FitDefinition,
+    FitStreamDecoder,
+    decode_fit_columns,
+    encode_fit_columns,
+    fit_crc,
+    fit_crc_combine,
+    parse_fit_header,
+    parse_field_transforms,
+)
+
+
+START_MS = 1_704_096_000_000
+RIDE_SECONDS = 600
+
+
+@pytest.fixture(autouse=True)
+def default_transforms(monkeypatch):
+    monkeypatch.setattr(
+        myWhoosh2Garmin, "FIELD_TRANSFORMS",
+        parse_field_transforms(myWhoosh2Garmin.DEFAULT_FIELD_TRANSFORMS)
+    )
+
+
+@pytest.fixture(scope="module")
+def ride() -> dict:
+    """A MyWhoosh-like ride without session averages, and its streams."""
+    rng = random.Random(7)
+    builder = FitFileBuilder(auto_define=True, min_string_size=50)
+    file_id = FileIdMessage()
+    file_id.type = FileType.ACTIVITY
+    file_id.manufacturer = Manufacturer.DEVELOPMENT.value
+    file_id.product = 0
+    file_id.serial_number = 0x12345678
+    file_id.time_created = START_MS
+    builder.add(file_id)
+    streams = {"power": [], "heart_rate": [], "cadence": []}
+    for second in range(RIDE_SECONDS):
+        record = RecordMessage()
+        record.timestamp = START_MS + second * 1000
+        for name, low, high in (("power", 150, 300),
+                                ("heart_rate", 120, 170),
+                                ("cadence", 80, 100)):
+            value = rng.randint(low, high)
+            setattr(record, name, value)
+            streams[name].append(value)
+        record.temperature = 20
+        builder.add(record)
+    session = SessionMessage()
+    session.timestamp = START_MS + RIDE_SECONDS * 1000
+    session.start_time = START_MS
+    session.total_elapsed_time = RIDE_SECONDS
+    session.total_timer_time = RIDE_SECONDS
+    session.sport = Sport.CYCLING
+    builder.add(session)
+    return {"data": builder.build().to_bytes(), "streams": streams}
+
+
+def test_crc_combine_matches_crc_of_concatenation():
+    rng = random.Random(1)
+    for length_a, length_b in ((0, 5), (7, 0), (13, 1000), (1, 65537)):
+        a = bytes(rng.getrandbits(8) for _ in range(length_a))
+        b = bytes(rng.getrandbits(8) for _ in range(length_b))
+        assert fit_crc_combine(fit_crc(a), fit_crc(b), len(b)) == fit_crc(a + b)
+
+
+def test_decode_encode_round_trip(ride):
+    data = ride["data"]
+    encoded = encode_fit_columns(decode_fit_columns(data))
+
+    # fit_tool writes a 12 byte header, the encoder always writes 14.
+    header_size, data_size = parse_fit_header(data)
+    new_header_size, new_data_size = parse_fit_header(encoded)
+    assert new_data_size == data_size
+    assert (encoded[new_header_size:-2]
+            == data[header_size:header_size + data_size])
+    assert fit_crc(encoded[:-2]) == struct.unpack_from("<H", encoded, -2)[0]
+
+
+def test_cleanup_fills_averages_and_drops_temperature(ride):
+    cleaned = myWhoosh2Garmin.cleanup_fit_columns(ride["data"])
+
+    header_size, data_size = parse_fit_header(cleaned)
+    assert len(cleaned) == header_size + data_size + 2
+    assert fit_crc(cleaned[:12]) == struct.unpack_from("<H", cleaned, 12)[0]
+    assert fit_crc(cleaned[:-2]) == struct.unpack_from("<H", cleaned, -2)[0]
+
+    messages = [record.message for record in FitFile.from_bytes(cleaned).records]
+    records = [m for m in messages if isinstance(m, RecordMessage)]
+    (session,) = [m for m in messages if isinstance(m, SessionMessage)]
+    assert len(records) == RIDE_SECONDS
+    assert all(record.temperature is None for record in records)
+    streams = ride["streams"]
+    assert session.avg_power == round(sum(streams["power"]) / RIDE_SECONDS)
+    assert session.avg_heart_rate == round(
+        sum(streams["heart_rate"]) / RIDE_SECONDS)
+    assert session.avg_cadence == round(sum(streams["cadence"]) / RIDE_SECONDS)
+
+
+def test_streamed_feed_equals_batch_cleanup(ride):
+    data = ride["data"]
+    header_size, data_size = parse_fit_header(data)
+    data_end = header_size + data_size
+    decoder = FitStreamDecoder()
+    cleaner = myWhoosh2Garmin.FitCleaner()
+    rng = random.Random(3)
+    offset = 0
+    while offset < len(data):
+        chunk = data[offset:offset + rng.randint(1, 4000)]
+        offset += len(chunk)
+        cleaner.add(decoder.feed(chunk,
+                                 data_end if offset == len(data) else None))
+
+    assert decoder.finished(data_end)
+    assert (cleaner.finish(decoder.header)
+            == myWhoosh2Garmin.cleanup_fit_columns(data))
+
+
+def test_rename_onto_existing_field_replaces_it(ride, monkeypatch):
+    monkeypatch.setattr(myWhoosh2Garmin, "FIELD_TRANSFORMS", parse_field_transforms([
+        {"message": "record", "field": "cadence", "action": "rename",
+         "to": "heart_rate"},
+    ]))
+    cleaned = myWhoosh2Garmin.cleanup_fit_columns(ride["data"])
+
+    for segment in decode_fit_columns(cleaned).segments:
+        if not isinstance(segment, FitDefinition):
+            continue
+        numbers = [number for number, _, _ in segment.fields]
+        assert len(numbers) == len(set(numbers))
+    records = [record.message for record in FitFile.from_bytes(cleaned).records
+               if isinstance(record.message, RecordMessage)]
+    assert [r.heart_rate for r in records] == ride["streams"]["cadence"]
+
+
+def test_rules_can_drop_session_averages(ride, monkeypatch):
+    monkeypatch.setattr(myWhoosh2Garmin, "FIELD_TRANSFORMS", parse_field_transforms([
+        {"message": "session", "field": "avg_power", "action": "drop"},
+    ]))
+    cleaned = myWhoosh2Garmin.cleanup_fit_columns(ride["data"])
+
+    (session,) = [record.message for record in FitFile.from_bytes(cleaned).records
+                  if isinstance(record.message, SessionMessage)]
+    assert session.avg_power is None
+    assert session.avg_cadence == round(
+        sum(ride["streams"]["cadence"]) / RIDE_SECONDS)
+
+
+def test_two_renames_to_one_field_are_rejected():
+    with pytest.raises(ValueError):
+        parse_field_transforms([
+            {"message": "record", "field": "cadence", "action": "rename",
+             "to": "field_62"},
+            {"message": "record", "field": "power", "action": "rename",
+             "to": "field_62"},
+        ])
+
+
+def test_fallback_transforms_floats_and_avoids_invalid_values(monkeypatch):
+    monkeypatch.setattr(myWhoosh2Garmin, "FIELD_TRANSFORMS", parse_field_transforms([
+        {"message": "record", "field": "field_114", "action": "scale",
+         "factor": 2.0},
+        {"message": "record", "field": "heart_rate", "action": "clamp",
+         "max": 300},
+    ]))
+    record = RecordMessage()
+    record.grit = 1.5
+    record.heart_rate = 120
+    myWhoosh2Garmin.transform_message(record)
+
+    assert record.grit == pytest.approx(3.0)
+    assert record.heart_rate == 120
+    # 255 is the invalid value of uint8 heart rate.
+    record.heart_rate = 254
+    monkeypatch.setattr(myWhoosh2Garmin, "FIELD_TRANSFORMS", parse_field_transforms([
+        {"message": "record", "field": "heart_rate", "action": "scale",
+         "offset": 10},
+    ]))
+    myWhoosh2Garmin.transform_message(record)
+    assert record.heart_rate == 254